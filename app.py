@@ -1,65 +1,254 @@
-import json
+import cProfile
+import html
+import io
 import os
-import re
+import pstats
+import threading
 import time
-import pandas as pd
+import tracemalloc
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import requests
 from urllib.parse import quote
-from dotenv import load_dotenv
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from streamlit_extras.metric_cards import style_metric_cards
 import pyperclip
 import altair as alt
 
-load_dotenv()
+from civitai_models_viewer.analytics import LABELS, Comparison, ImageMetaStore, compare
+from civitai_models_viewer.api import get_model, get_models, iter_image_pages
+from civitai_models_viewer.blobs import BlobStore
+from civitai_models_viewer.bundle import bundle_workflows
+from civitai_models_viewer.cache import ResponseCache
+from civitai_models_viewer.catalog import ModelCatalog, sync_forever
+from civitai_models_viewer.config import (
+    ANALYTICS_PATH, BLOBS_MAX_BYTES, CATALOG_PATH, CATALOG_SYNC_INTERVAL, MAX_WORKERS, METRICS_PORT, REFRESH_INTERVAL,
+    REFRESH_RATE, SEARCH_PATH, STORE_MAX_BYTES, THUMBNAILS_FORMAT, THUMBNAILS_HOSTS, THUMBNAILS_MAX_BYTES, THUMBNAILS_PATH,
+    THUMBNAILS_PORT, THUMBNAILS_URL, WATCHLIST
+)
+from civitai_models_viewer.metrics import METRICS, serve
+from civitai_models_viewer.refresh import Refresher
+from civitai_models_viewer.search import PromptIndex
+from civitai_models_viewer.store import ModelStore, PendingImages, compact_image, compact_model, normalize_query
+from civitai_models_viewer.stats import DISTRIBUTION, VersionStats, images_digest, images_frame, version_stats
+from civitai_models_viewer.thumbnails import ThumbnailProxy, thumbnail_url
+from civitai_models_viewer.thumbnails import serve as serve_thumbnails
+from civitai_models_viewer.workflows import WorkflowIndex, pretty_workflow
 
-CIVITAI_TOKEN = os.getenv('CIVITAI_TOKEN')
 PAGE_TITLE = "Civitai Model Extractor"
 PAGE_ICON = "🚀"
-API_URL = 'https://civitai.com/api/v1/'
 
 VERSION = 'v0.1.1'
 
+WORKFLOW_CACHE_SIZE = int(os.getenv('CIVITAI_WORKFLOW_CACHE_SIZE', 64))
+
+GALLERY_COLUMNS = int(os.getenv('CIVITAI_GALLERY_COLUMNS', 4))
+GALLERY_ROWS = int(os.getenv('CIVITAI_GALLERY_ROWS', 3))
+
+# option of the matching models running the live search instead of a catalog match
+LIVE_SEARCH = 0
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    '''bounded thread pool used to prefetch images'''
+    return ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='civitai')
+
+@st.cache_resource
+def get_workflow_index() -> WorkflowIndex:
+    '''ComfyUI workflows of every ingested image'''
+    return WorkflowIndex(get_store().blobs)
+
+@st.cache_resource
+def get_prompt_index() -> PromptIndex:
+    '''full text index of every fetched image prompt'''
+    return PromptIndex(SEARCH_PATH)
+
+@st.cache_resource
+def get_store() -> ModelStore:
+    '''compact models and images shared by every session'''
+    return ModelStore(STORE_MAX_BYTES, blobs=BlobStore(BLOBS_MAX_BYTES))
+
+@st.cache_resource
+def get_pending_images() -> dict[int, PendingImages]:
+    '''versions whose images are being fetched, by version id'''
+    return {}
+
+@st.cache_resource
+def get_image_meta_store() -> ImageMetaStore:
+    '''columnar store of the metadata of every fetched image, for comparisons'''
+    return ImageMetaStore(ANALYTICS_PATH)
+
+@st.cache_resource
+def get_catalog() -> ModelCatalog:
+    '''local catalog of every model name, answering the sidebar search'''
+    return ModelCatalog(CATALOG_PATH)
+
+@st.cache_resource
+def start_catalog_sync() -> None:
+    '''build the catalog name index, then keep the catalog in sync when an interval is configured,
+    from a daemon thread once per process: searches match nothing until the index is built'''
+    threading.Thread(
+        target=sync_forever,
+        args=(get_catalog(), CATALOG_SYNC_INTERVAL),
+        daemon=True,
+        name='catalog_sync'
+    ).start()
+
+@st.cache_resource
+def get_refresher() -> Refresher | None:
+    '''background refresher of the watched models once per process, None without a watchlist'''
+    if WATCHLIST:
+        return Refresher(get_store(), WATCHLIST, REFRESH_INTERVAL, REFRESH_RATE, ingest=ingest_images).start()
+
+@st.cache_resource
+def start_metrics_server() -> None:
+    '''serve metrics for Prometheus once per process, when a port is configured'''
+    if METRICS_PORT:
+        serve(METRICS_PORT)
+
+@st.cache_resource
+def start_thumbnail_proxy() -> bool:
+    '''serve resized images once per process, False when disabled or the port is taken'''
+    if not THUMBNAILS_PORT:
+        return False
+    proxy = ThumbnailProxy(
+        ResponseCache(THUMBNAILS_PATH, max_bytes=THUMBNAILS_MAX_BYTES),
+        image_format=THUMBNAILS_FORMAT,
+        hosts=THUMBNAILS_HOSTS
+    )
+    try:
+        serve_thumbnails(THUMBNAILS_PORT, proxy)
+    except OSError:
+        return False
+    return True
+
+def thumbnail(url: str | None, width: int) -> str | None:
+    '''url of the thumbnail of an image, the original when the proxy is not running'''
+    if url and start_thumbnail_proxy():
+        return thumbnail_url(THUMBNAILS_URL, url, width)
+    return url
+
+def age(timestamp: float) -> str:
+    '''how long ago a snapshot was fetched'''
+    minutes = (time.time() - timestamp) / 60
+    if minutes < 1:
+        return "just now"
+    return f"{minutes:.0f} min ago" if minutes < 90 else f"{minutes / 60:.0f} h ago"
+
+def session_id() -> str:
+    '''id of the browser session running the script'''
+    return get_script_run_ctx().session_id
+
+@METRICS.timed('civitai_section_seconds', section='get_models_infos')
 def get_models_infos(model_name: str) -> dict:
     '''get models infos from civitai'''
-    model = quote(model_name)
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {CIVITAI_TOKEN}"
-    }
     try:
-        response = requests.get(f"{API_URL}models?query={model}", headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        return data
+        return get_models(model_name)
     except requests.exceptions.RequestException as e:
         st.error(e)
 
-def get_images(version_id: int, model_id: int) -> list:
-    '''get images from version id model'''
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {CIVITAI_TOKEN}"
-    }
+@METRICS.timed('civitai_section_seconds', section='get_model_infos')
+def get_model_infos(model_id: int) -> dict:
+    '''get full details of a model selected in the catalog from civitai'''
     try:
-        response = requests.get(f"{API_URL}images?limit=200&modelVersionId={version_id}&modelId={model_id}", headers=headers)
-        # response = requests.get(f"https://civitai.com/api/v1/images?modelVersionId={version_id}", headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        return data
+        return get_model(model_id)
     except requests.exceptions.RequestException as e:
         st.error(e)
 
+def watched_models(models: dict) -> dict:
+    '''models with the watched ones replaced by the snapshot the refresher keeps warm, when stored'''
+    if (refresher := get_refresher()) is None:
+        return models
+    items = []
+    for model in models['items']:
+        snapshot = get_store().get(('model', model['id']), session_id()) if model['id'] in refresher.watchlist else None
+        items.append(snapshot['items'][0] if snapshot else model)
+    return {**models, 'items': items}
+
+def ingest_images(model: dict, version: dict, items: list) -> None:
+    '''index prompts of a page of images, append their metadata and move their workflows out
+
+    The prompt index and the comparison store are optional: their failures are counted, not raised.
+    '''
+    indexes = {
+        'prompts': lambda: get_prompt_index().add(model, version, items),
+        'analytics': lambda: get_image_meta_store().append(model, version, items),
+    }
+    for name, add in indexes.items():
+        try:
+            add()
+        except Exception:
+            METRICS.count('civitai_index_errors_total', index=name)
+    for img in items:
+        get_workflow_index().ingest(img)
+
+@METRICS.timed('civitai_section_seconds', section='get_images')
+def stream_images(pending: PendingImages, model: dict, version: dict) -> None:
+    '''index image pages of a version, publish them as they arrive and store them once complete
+
+    Runs in the prefetch worker threads: errors are kept for the readers, not displayed.
+    Images are stored only once complete, so an interrupted fetch is retried by the next rerun.
+    '''
+    images = {'items': [], 'metadata': {}}
+    try:
+        for page in iter_image_pages(version_id=version['id'], model_id=model['id'], blobs=get_store().blobs):
+            ingest_images(model, version, page['items'])
+            items = [compact_image(img) for img in page['items']]
+            images['items'].extend(items)
+            images['metadata'] = page['metadata']
+            pending.add(items, page['metadata'])
+    except Exception as e:
+        pending.fail(e)
+    else:
+        images['fetched_at'] = time.time()
+        get_store().put(('images', version['id']), images)
+    finally:
+        get_pending_images().pop(version['id'], None)
+        pending.finish()
+
+def fetch_images(model: dict, version: dict) -> PendingImages:
+    '''images of a version being fetched, submitted to the thread pool unless already running'''
+    pending = PendingImages()
+    if (running := get_pending_images().setdefault(version['id'], pending)) is pending:
+        get_executor().submit(stream_images, pending, model=model, version=version)
+    return running
+
+def prefetch_images(models: dict) -> None:
+    '''submit images of every model version neither stored nor being fetched to the thread pool'''
+    store = get_store()
+    for model in models['items']:
+        for version in model['modelVersions']:
+            if store.get(('images', version['id'])) is None:
+                fetch_images(model, version)
+
+def receive_images(model: dict, version: dict) -> Iterator[tuple[dict, list]]:
+    '''yield images received so far and the new ones, page by page as they arrive
+
+    Workers store the images once complete: expanders only read them, fetching them
+    again when they were evicted since the last prefetch.
+    '''
+    if images := get_store().get(('images', version['id']), session_id()):
+        yield images, images['items']
+        return
+    pending = fetch_images(model, version)
+    yield from pending.follow()
+    for error in pending.errors:
+        st.error(error)
+    get_store().get(('images', version['id']), session_id())
+
 st.set_page_config(
     page_title=PAGE_TITLE, 
     page_icon=PAGE_ICON, 
     layout="wide"
 )
 
+@st.fragment
 def popover_image_metadata(image: dict, version_id: int) -> None:
     '''popup image metadata'''
     model, prompt, prompt_html, negative_prompt, negative_prompt_html, seed, steps, cfg_scale, sampler, clip_skip = [None] * 10
-    if meta:= image.get('meta'):
+    if meta:= get_store().image_meta(image):
         model = meta.get('Model', 'Not provided')
         prompt = meta.get('prompt', 'Not provided')
         negative_prompt = meta.get('negativePrompt', 'Not provided')
@@ -102,16 +291,12 @@ Model: {model}</p>"""
     st.markdown(msg_prompt, unsafe_allow_html=True)
     if st.button("Copy Prompt", key=f"copy_prompt_{image['id']}_{version_id}", type="primary"):
         pyperclip.copy(prompt)
-        success_prompt = st.success("copied!")
-        time.sleep(2)
-        success_prompt.empty()
+        st.toast("Prompt copied!")
 
     st.markdown(msg_negative, unsafe_allow_html=True)
     if st.button("Copy Negative Prompt", key=f"copy_negative_{image['id']}_{version_id}", type="primary"):
         pyperclip.copy(negative_prompt)
-        success_neg = st.success("copied!")
-        time.sleep(2)
-        success_neg.empty()
+        st.toast("Negative prompt copied!")
 
     msg_extra = msg_extra.format(
         seed=seed,
@@ -122,58 +307,448 @@ Model: {model}</p>"""
     )
     st.markdown(msg_extra, unsafe_allow_html=True)
 
-def get_data_sampler(imgs: list) -> pd.DataFrame:
-    '''get data sampler'''
-    sampler = []
-    count =  []
+@st.cache_data(max_entries=512, show_spinner=False)
+@METRICS.timed('civitai_section_seconds', section='stats')
+def get_version_stats(version_id: int, digest: str, _items: list) -> VersionStats:
+    '''generation stats of version images, memoized by version id and content hash'''
+    return version_stats(images_frame(_items))
+
+@METRICS.timed('civitai_section_seconds', section='charts')
+def render_stats(stats: VersionStats) -> None:
+    '''render sampler, steps and CFG charts of a version'''
+    _, col_2, _ = st.columns(3)
+    with col_2:
+        data = alt.Chart(stats.samplers).mark_arc().encode(
+            theta="count",              
+            color="sampler",
+            tooltip=["sampler", "count"],
+        )
+        st.altair_chart(
+            data, 
+            use_container_width=False
+        )
+    col_1, col_2 = st.columns(2)
+    with col_1:
+        data = alt.Chart(stats.steps).mark_bar().encode(
+            x="samplers:N",
+            y="steps:Q",
+            xOffset=alt.XOffset("group:N", sort=list(DISTRIBUTION.values())),
+            color=alt.Color('group:N', sort=list(DISTRIBUTION.values())),
+            tooltip=["samplers", "group", "steps"],
+        )
+        st.altair_chart(
+            data, 
+            use_container_width=True,
+            theme="streamlit"
+        )
+        data = alt.Chart(stats.steps_histogram).mark_bar().encode(
+            x="steps:O",
+            y="count:Q",
+            color="sampler:N",
+            tooltip=["sampler", "steps", "count"],
+        )
+        st.altair_chart(
+            data, 
+            use_container_width=True,
+            theme="streamlit"
+        )
+    with col_2:
+        data = alt.Chart(stats.cfg).mark_bar().encode(
+            x="samplers:N",
+            y="CFG:Q",
+            xOffset=alt.XOffset("group:N", sort=list(DISTRIBUTION.values())),
+            color=alt.Color('group:N', sort=list(DISTRIBUTION.values())),
+            tooltip=["samplers", "group", "CFG"],
+        )
+        st.altair_chart(
+            data, 
+            use_container_width=True,
+            theme="streamlit"
+        )
+        data = alt.Chart(stats.cfg_histogram).mark_bar().encode(
+            x="cfgScale:O",
+            y="count:Q",
+            color="sampler:N",
+            tooltip=["sampler", "cfgScale", "count"],
+        )
+        st.altair_chart(
+            data, 
+            use_container_width=True,
+            theme="streamlit"
+        )
+
+def get_workflow_bundle(models: list) -> bytes:
+    '''ZIP of the deduplicated workflows and metadata of every loaded image of the models, built on download'''
+    store = get_store()
+    images = (
+        (model, version, img)
+        for model in models
+        for version in model['modelVersions']
+        for img in (store.get(('images', version['id'])) or {'items': []})['items']
+    )
+    with bundle_workflows(images, get_workflow_index(), store.raw_image) as archive:
+        return archive.read()
+
+@st.cache_data(max_entries=WORKFLOW_CACHE_SIZE, show_spinner=False)
+def get_workflow(image_id: int) -> str | None:
+    '''indented workflow of image, None when its comfy blob has no graph or was dropped
+
+    Built when the image is shown, to enable its download button, then served from here.
+    '''
+    if (blob := get_workflow_index().blob(image_id)) is None:
+        return None
+    return pretty_workflow(blob)
+
+def render_image(img: dict, version_id: int) -> None:
+    '''render gallery image with its metadata, workflow and civitai buttons'''
+    width = 1400 // st.session_state.get('gallery_columns', GALLERY_COLUMNS)
+    st.markdown(
+        f"<a href=\"{html.escape(img['url'])}\" target=\"_blank\">"
+        f"<img class=\"nx-thumbnail\" src=\"{html.escape(thumbnail(img['url'], width))}\" loading=\"lazy\"></a>",
+        unsafe_allow_html=True
+    )
+    c_1, c_2, c_3 = st.columns(3, gap='small')
+    with c_1.popover("ℹ️", use_container_width=True):
+        popover_image_metadata(image=img, version_id=version_id)
+    has_workflow = img['id'] in get_workflow_index() and get_workflow(img['id']) is not None
+    c_2.download_button(
+        label="WF",
+        data=partial(get_workflow, img['id']) if has_workflow else '',
+        mime="text/json",
+        key=f"nodes_{img['id']}_{version_id}", 
+        file_name=f"wf_{img['id']}.json",
+        use_container_width=True,
+        disabled=not has_workflow
+    )
+    c_3.link_button("📷", f"https://civitai.com/images/{img['id']}", use_container_width=True)
+
+def gallery_end(version_id: int) -> int:
+    '''number of images needed to fill the visible gallery page of a version'''
+    nb_columns = st.session_state.get('gallery_columns', GALLERY_COLUMNS)
+    return st.session_state.get(f"gallery_page_{version_id}", 1) * nb_columns * GALLERY_ROWS
+
+def render_pager(nb_images: int, version_id: int, receiving: bool) -> int:
+    '''render the page picker of a gallery and return the visible page
+
+    A widget key is emitted once per run: while pages are received the count is
+    rendered as text, again for every page, and the picker once they all arrived.
+    '''
+    nb_pages = max(1, -(-nb_images // (st.session_state.get('gallery_columns', GALLERY_COLUMNS) * GALLERY_ROWS)))
+    key = f"gallery_page_{version_id}"
+    if receiving:
+        st.caption(f"Page {st.session_state.get(key, 1)} / {nb_pages}+")
+        return st.session_state.get(key, 1)
+    if st.session_state.get(key, 1) > nb_pages:
+        st.session_state[key] = nb_pages
+    return st.number_input(f"Page / {nb_pages}", min_value=1, max_value=nb_pages, key=key)
+
+@METRICS.timed('civitai_section_seconds', section='gallery')
+def render_gallery(images: list, version_id: int, page: int) -> None:
+    '''render a page of images in a grid, only its widgets are emitted'''
+    nb_columns = st.session_state.get('gallery_columns', GALLERY_COLUMNS)
+    page_size = nb_columns * GALLERY_ROWS
+    columns = st.columns(nb_columns)
+    for n, img in enumerate(images[(page - 1) * page_size:page * page_size]):
+        with columns[n % nb_columns]:
+            render_image(img, version_id)
+
+@st.fragment
+def render_version(model: dict, version: dict) -> None:
+    '''render version expander: infos, stats and images
+
+    Nothing is rendered, nor waited for, until the expander is opened. The gallery
+    is rendered as soon as its visible page is filled, stats and page count follow every page.
+    '''
+    expander = st.expander(f"{version['name']}", key=f"version_{version['id']}", on_change="rerun")
+    if not expander.open:
+        return
+    with expander:
+        infos = st.empty()
+        infos.markdown(f"Download: [{version['id']}]({version['downloadUrl']})<br>Images: 0", unsafe_allow_html=True)
+
+        st.subheader("Stats", divider="blue")
+        stats = st.empty()
+        images_title = st.empty()
+        pager = st.empty()
+        gallery = st.empty()
+
+        imgs = None
+        gallery_shown = False
+        for imgs, _ in receive_images(model, version):
+            nb_images = f"{len(imgs['items'])}{'+' if imgs['metadata'].get('truncated') else ''}"
+            fetched = f" · fetched {age(imgs['fetched_at'])}" if 'fetched_at' in imgs else ''
+            infos.markdown(f"Download: [{version['id']}]({version['downloadUrl']})<br>Images: {nb_images}{fetched}", unsafe_allow_html=True)
+            if imgs['items']:
+                with stats.container():
+                    render_stats(get_version_stats(version['id'], images_digest(imgs['items']), imgs['items']))
+                images_title.subheader(f"Images / {nb_images}", divider="blue")
+                with pager.container():
+                    page = render_pager(len(imgs['items']), version['id'], receiving=True)
+            if not gallery_shown and len(imgs['items']) >= gallery_end(version['id']):
+                with gallery.container():
+                    render_gallery(imgs['items'], version_id=version['id'], page=page)
+                gallery_shown = True
+
+        if imgs and imgs['items']:
+            with pager.container():
+                page = render_pager(len(imgs['items']), version['id'], receiving=False)
+            if not gallery_shown:
+                with gallery.container():
+                    render_gallery(imgs['items'], version_id=version['id'], page=page)
+            st.download_button(
+                "All workflows",
+                data=partial(get_workflow_bundle, [{**model, 'modelVersions': [version]}]),
+                file_name=f"workflows_{version['id']}.zip",
+                mime="application/zip",
+                key=f"bundle_{version['id']}",
+                on_click="ignore",
+                icon="📦"
+            )
+
+@st.cache_data(max_entries=64, show_spinner=False)
+@METRICS.timed('civitai_section_seconds', section='compare')
+def get_comparison(model_ids: tuple[int, ...], group: str, generation: int) -> Comparison:
+    '''aggregates of the stored images of models, memoized until the store is appended to'''
+    frame = get_image_meta_store().frame(
+        list(model_ids),
+        columns=[group, LABELS[group], 'base_model', 'width', 'height', 'sampler', 'steps', 'cfg_scale']
+    )
+    return compare(frame, group)
+
+@st.fragment
+def render_compare() -> None:
+    '''compare samplers, steps, CFG, resolutions and base models across models or the versions of one'''
+    with st.expander("📊 Compare", key="compare", on_change="rerun") as expander:
+        if not expander.open:
+            return
+        store = get_image_meta_store()
+        versions = store.versions()
+        if versions.empty:
+            st.info("Comparisons cover the images fetched so far: load some models first")
+            return
+        models = versions.groupby(['model_id', 'model_name'], dropna=False)['images'].sum().reset_index()
+        names = dict(zip(models['model_id'], models['model_name']))
+        counts = dict(zip(models['model_id'], models['images']))
+        model_ids = st.multiselect(
+            "Models",
+            list(names),
+            format_func=lambda model_id: f"{names[model_id]} #{model_id} · {counts[model_id]:,} images",
+            key="compare_models"
+        )
+        if not model_ids:
+            return
+        group = 'version_id' if len(model_ids) == 1 else 'model_id'
+        comparison = get_comparison(tuple(sorted(model_ids)), group, store.generation)
+        label = "Version" if group == 'version_id' else "Model"
+        st.dataframe(comparison.images, column_config={group: "ID", 'label': label, 'images': "Images"}, hide_index=True)
+
+        col_1, col_2 = st.columns(2)
+        with col_1:
+            st.altair_chart(
+                alt.Chart(comparison.samplers).mark_bar().encode(
+                    x=alt.X("share:Q", axis=alt.Axis(format='%'), title="Sampler share"),
+                    y=alt.Y("label:N", title=label),
+                    color="sampler:N",
+                    tooltip=[alt.Tooltip("label:N", title=label), "sampler", "count", alt.Tooltip("share:Q", format='.1%')],
+                ),
+                use_container_width=True
+            )
+        with col_2:
+            st.altair_chart(
+                alt.Chart(comparison.base_models).mark_bar().encode(
+                    x=alt.X("share:Q", axis=alt.Axis(format='%'), title="Base model share"),
+                    y=alt.Y("label:N", title=label),
+                    color="base_model:N",
+                    tooltip=[alt.Tooltip("label:N", title=label), "base_model", "count", alt.Tooltip("share:Q", format='.1%')],
+                ),
+                use_container_width=True
+            )
+        for (column, title), col in zip((('steps', "Steps"), ('cfg', "CFG")), st.columns(2)):
+            quantiles = getattr(comparison, column)
+            base = alt.Chart(quantiles).encode(x=alt.X("label:N", title=label))
+            with col:
+                st.altair_chart(
+                    base.mark_rule().encode(y=alt.Y("min:Q", title=title), y2="max:Q")
+                    + base.mark_bar(size=20).encode(y="p25:Q", y2="p75:Q", tooltip=[alt.Tooltip("label:N", title=label), "min", "p25", "median", "mean", "p75", "max"])
+                    + base.mark_tick(color="white", size=20).encode(y="median:Q"),
+                    use_container_width=True
+                )
+        st.altair_chart(
+            alt.Chart(comparison.resolutions).mark_rect().encode(
+                x=alt.X("resolution:N", title="Resolution", sort='-color'),
+                y=alt.Y("label:N", title=label),
+                color=alt.Color("share:Q", legend=alt.Legend(format='%')),
+                tooltip=[alt.Tooltip("label:N", title=label), "resolution", "count", alt.Tooltip("share:Q", format='.1%')],
+            ),
+            use_container_width=True
+        )
+
+@st.fragment
+def render_search() -> None:
+    '''search prompts of every fetched image, filtered by sampler, steps and CFG'''
+    index = get_prompt_index()
+    with st.expander("🔎 Prompt search"):
+        text = st.text_input("Prompt", key="search_prompt")
+        facets = index.facets()
+        col_1, col_2, col_3 = st.columns(3)
+        samplers = col_1.multiselect("Sampler", facets['samplers'], key="search_samplers")
+        steps = cfg = None
+        if None not in facets['steps'] and facets['steps'][0] < facets['steps'][1]:
+            bounds = tuple(map(int, facets['steps']))
+            steps = col_2.slider("Steps", *bounds, value=bounds, key="search_steps")
+            # the full range does not filter: images without steps stay in the results
+            steps = None if steps == bounds else steps
+        if None not in facets['cfg'] and facets['cfg'][0] < facets['cfg'][1]:
+            bounds = tuple(map(float, facets['cfg']))
+            cfg = col_3.slider("CFG", *bounds, value=bounds, key="search_cfg")
+            cfg = None if cfg == bounds else cfg
+        negative = st.checkbox("Include negative prompt", key="search_negative")
+        version_ids = None
+        if st.session_state['model_name'] and (models := get_store().get(('query', normalize_query(st.session_state['model_name'])))):
+            if st.checkbox("Only current query", value=True, key="search_current"):
+                version_ids = [version['id'] for model in models['items'] for version in model['modelVersions']]
+        if not text and not samplers:
+            return
+
+        filters = dict(negative=negative, samplers=samplers, steps=steps, cfg=cfg, version_ids=version_ids)
+        st.dataframe(
+            index.versions(text, **filters),
+            column_config={'version_id': None, 'model_name': "Model", 'version_name': "Version", 'images': "Images"},
+            hide_index=True
+        )
+        images = index.search(text, **filters)
+        for img in images:
+            img['link'] = f"https://civitai.com/images/{img['image_id']}"
+            img['url'] = thumbnail(img['url'], 64)
+        st.dataframe(
+            images,
+            column_order=['url', 'model_name', 'version_name', 'sampler', 'steps', 'cfg_scale', 'seed', 'snippet', 'link'],
+            column_config={
+                'url': st.column_config.ImageColumn("Image"),
+                'model_name': "Model",
+                'version_name': "Version",
+                'sampler': "Sampler",
+                'steps': "Steps",
+                'cfg_scale': "CFG",
+                'seed': "Seed",
+                'snippet': "Prompt",
+                'link': st.column_config.LinkColumn("Civitai", display_text="📷"),
+            },
+            hide_index=True
+        )
+
+@st.fragment
+def render_model(model: dict) -> None:
+    '''render model card and its versions'''
+    author = ''
+    author_img = ''
+    if 'creator' in model:
+        author_img = f"<div class=\"nx-tumbnail\" style=\"background-image: url({thumbnail(model['creator']['image'], 64)});\"></div> " if model['creator']['image'] else ''
+        author = f"[{model['creator']['username']}](https:/civitai.com/user/{model['creator']['username']})"
+    author_title = f"{author_img}{author}"
+
+    st.subheader(f"[{model['name']}](https:/civitai.com/models/{model['id']})", divider=True)
+    st.markdown(f"##### {author_img}{author}", unsafe_allow_html=True)
+    if (refresher := get_refresher()) and model['id'] in refresher.watchlist:
+        if model['id'] == refresher.refreshing:
+            st.caption("👁 Watched, refreshing…")
+        elif model['id'] in refresher.errors:
+            st.caption(f"👁 Watched, last refresh failed: {refresher.errors[model['id']]}")
+        elif model['id'] in refresher.refreshed:
+            st.caption(f"👁 Watched, refreshed {age(refresher.refreshed[model['id']])}")
+
+    infos_str = \
+"""
+- ID: {id}
+- Type: {type}
+- NSFW: {nsfw}
+- Tags: {tags}
+"""     
+    infos_str = infos_str.format(
+        id=model['id'],
+        type=model['type'],
+        nsfw=model['nsfw'],
+        tags=', '.join(f"[{tag}](https:/civitai.com/tag/{quote(tag)})" for tag in model['tags'])
+    )
+    st.markdown(infos_str, unsafe_allow_html=True)
+
+    m_1, m_2, m_3, m_4 = st.columns(4)
+
+    m_1.metric(label="📥 Download", value=model['stats'].get('downloadCount'), delta='')
+    m_2.metric(label="👍 Likes", value=model['stats'].get('thumbsUpCount'))
+    m_3.metric(label="👎 Unlikes", value=model['stats'].get('thumbsDownCount'))
+    m_4.metric(label="💬 Comments", value=model['stats'].get('commentCount'))
+    style_metric_cards(
+        border_left_color="#FF4B4B",
+    )
     
-    for img in imgs['items']:
-        if meta:= img.get('meta'):
-            if sp:= meta.get('sampler'):
-                if sp not in sampler:
-                    sampler.append(sp)
-                    count.append(1)
-                else:
-                    count[sampler.index(sp)] += 1
-            
-    return pd.DataFrame({'sampler': sampler, 'count': count})
-
-def get_data_steps(imgs: list) -> pd.DataFrame:
-    '''get data steps'''
-    steps_by_sampler = {}    
-    for img in imgs['items']:
-        if meta:= img.get('meta'):
-            if sp:= meta.get('sampler') :
-                if stp:= meta.get('steps'):
-                    if sp not in steps_by_sampler:
-                        steps_by_sampler[sp] = []
-                    steps_by_sampler[sp].append(stp)
-            
-    return steps_by_sampler
-
-def get_data_CFG(imgs: list) -> pd.DataFrame:
-    '''get data CFG'''
-    CFG_by_sampler = {}    
-    for img in imgs['items']:
-        if meta:= img.get('meta'):
-            if sp:= meta.get('sampler') :
-                if stp:= meta.get('cfgScale'):
-                    if sp not in CFG_by_sampler:
-                        CFG_by_sampler[sp] = []
-                    CFG_by_sampler[sp].append(stp)
-            
-    return CFG_by_sampler
+    st.write("##### Versions")
+    for version in model['modelVersions']:
+        render_version(model, version)
+    description = st.expander("Description", key=f"description_{model['id']}", on_change="rerun")
+    if description.open:
+        description.markdown(get_store().description(model), unsafe_allow_html=True)
+
+def start_profiling() -> tuple[cProfile.Profile | None, bool]:
+    '''start cProfile and tracemalloc for this rerun when asked in the debug panel
+
+    Return the profiler and whether this rerun started tracemalloc: it traces the whole
+    process, so a rerun of another session tracing already gets no allocations report.
+    '''
+    profiler = None
+    tracing = False
+    if st.session_state.get('debug') and st.session_state.get('debug_cprofile'):
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if st.session_state.get('debug') and st.session_state.get('debug_tracemalloc') and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        tracing = True
+    return profiler, tracing
+
+def stop_profiling(profiler: cProfile.Profile | None, tracing: bool) -> tuple[str | None, str | None]:
+    '''stop cProfile and the tracemalloc this rerun started, return the top of the profile and of the allocations'''
+    profile = allocations = None
+    if profiler:
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(25)
+        profile = output.getvalue()
+    if tracing and tracemalloc.is_tracing():
+        top = tracemalloc.take_snapshot().statistics('lineno')[:15]
+        tracemalloc.stop()
+        allocations = '\n'.join(str(stat) for stat in top)
+    return profile, allocations
+
+def render_debug(profile: str | None, allocations: str | None) -> None:
+    '''debug panel: metrics, their export and the profile of this rerun'''
+    if not st.session_state.get('debug'):
+        return
+    with st.sidebar.expander("Debug", expanded=True):
+        st.checkbox("cProfile reruns", key="debug_cprofile")
+        st.checkbox("tracemalloc reruns", key="debug_tracemalloc")
+        hit_ratio = METRICS.ratio('civitai_cache_requests_total', 'result', 'hit')
+        st.metric("Cache hit ratio", f"{hit_ratio:.0%}" if hit_ratio is not None else "-")
+        st.dataframe(METRICS.summary(), hide_index=True)
+        col_1, col_2 = st.columns(2)
+        col_1.download_button("Prometheus", METRICS.prometheus, file_name="metrics.prom", mime="text/plain")
+        col_2.download_button("JSON lines", METRICS.jsonl, file_name="metrics.jsonl", mime="application/jsonl")
+        if profile:
+            st.code(profile, language=None)
+        if allocations:
+            st.code(allocations, language=None)
 
 ################
 # INIT SESSION #
 ################
 if 'model_name' not in st.session_state:
     st.session_state['model_name'] = None
-if 'models' not in st.session_state:
-    st.session_state['models'] = {}
 if 'popup_wf' not in st.session_state:
     st.session_state['popup_wf'] = False
 
+start_metrics_server()
+start_catalog_sync()
+get_refresher()
+
 #########
 # STYLE #
 #########
@@ -190,6 +765,11 @@ div.nx-tumbnail {
     vertical-align: middle;
     margin-right: 15px;
 }
+
+img.nx-thumbnail {
+    width: 100%;
+    border-radius: 0.5rem;
+}
             
 div.stHeadingContainer  a {
     text-decoration: none;
@@ -210,271 +790,91 @@ div[data-testid="stPopoverBody"] {
     unsafe_allow_html=True
 )
 
-with st.sidebar:
-    st.header(f"{PAGE_TITLE} {PAGE_ICON}")
-    st.subheader(f"Version: {VERSION}")
-    model_name = st.text_input("Model Name", key="input_model_name")
-
-if model_name:
-    st.session_state['model_name'] = model_name
-    st.write(f"Query: ***{st.session_state['model_name']}***")
-
-    if st.session_state['models'].get(st.session_state['model_name']) is None:
-        models = get_models_infos(st.session_state['model_name'])
-        st.session_state['models'][st.session_state['model_name']] = models
-
-    models = st.session_state['models'][st.session_state['model_name']]
-
-    if len(models['items']) == 0:
-        st.error(f"{st.session_state['model_name']} seem to not exist on Civitai.")
-    else:    
-        
-        nb_models = len(models['items'])
-        st.success(f"Found {nb_models} model{'s' if nb_models > 1 else ''}")
-        
-        for model in models['items']:
-            author = ''
-            author_img = ''
-            if 'creator' in model:
-                author_img = f"<div class=\"nx-tumbnail\" style=\"background-image: url({model['creator']['image']});\"></div> " if model['creator']['image'] else ''
-                author = f"[{model['creator']['username']}](https:/civitai.com/user/{model['creator']['username']})"
-            author_title = f"{author_img}{author}"
-
-            st.subheader(f"[{model['name']}](https:/civitai.com/models/{model['id']})", divider=True)
-            st.markdown(f"##### {author_img}{author}", unsafe_allow_html=True)
-
-            infos_str = \
-"""
-- ID: {id}
-- Type: {type}
-- NSFW: {nsfw}
-- Tags: {tags}
-"""     
-            infos_str = infos_str.format(
-                id=model['id'],
-                type=model['type'],
-                nsfw=model['nsfw'],
-                tags=', '.join(f"[{tag}](https:/civitai.com/tag/{quote(tag)})" for tag in model['tags'])
+profiler, tracing = start_profiling()
+try:
+    with st.sidebar:
+        st.header(f"{PAGE_TITLE} {PAGE_ICON}")
+        st.subheader(f"Version: {VERSION}")
+        model_name = st.text_input("Model Name", key="input_model_name")
+        matches = {match['model_id']: match for match in get_catalog().search(model_name)} if model_name else {}
+        if matches:
+            st.selectbox(
+                "Matching models",
+                [*matches, LIVE_SEARCH],
+                index=None,
+                format_func=lambda model_id: f"🔎 Search Civitai for '{model_name}'" if model_id == LIVE_SEARCH else f"{matches[model_id]['name']} · {matches[model_id]['type']} · {matches[model_id]['downloads']:,} ⬇",
+                placeholder=f"Choose among {len(matches)} models",
+                key="catalog_model"
+            )
+        st.select_slider("Gallery columns", options=[2, 3, 4, 5, 6], value=GALLERY_COLUMNS, key="gallery_columns")
+        store_stats = get_store().stats()
+        st.caption(
+            f"Memory: {get_store().footprint(session_id()) / 2**20:.1f} MB this session, "
+            f"{store_stats['bytes'] / 2**20:.1f} / {store_stats['max_bytes'] / 2**20:.0f} MB shared, "
+            f"{store_stats['blob_bytes'] / 2**20:.1f} MB spilled"
+        )
+        if synced_at := get_catalog().state('synced_at'):
+            st.caption(f"Catalog: {len(get_catalog()):,} models, synced {age(float(synced_at))}")
+        if refresher := get_refresher():
+            st.caption(f"Watchlist: {len(refresher.refreshed)} / {len(refresher.watchlist)} models warm")
+        st.toggle("Debug", key="debug")
+
+    render_search()
+    render_compare()
+
+    if model_name:
+        st.session_state['model_name'] = model_name
+        st.write(f"Query: ***{st.session_state['model_name']}***")
+
+        if matches and (model_id := st.session_state.get('catalog_model')) in matches:
+            query = ('model', model_id)
+            models = get_store().get(query, session_id())
+            if models is None and (model := get_model_infos(model_id)) is not None:
+                models = {'items': [compact_model(model, get_store().blobs)], 'fetched_at': time.time()}
+                get_store().put(query, models, session_id())
+        elif any(not match['fuzzy'] for match in matches.values()) and st.session_state.get('catalog_model') != LIVE_SEARCH:
+            # names matched by prefix are in the catalog, others only look alike and fall back to the live search
+            st.info("Choose one of the matching models in the sidebar, or search Civitai")
+            st.dataframe(
+                list(matches.values()),
+                column_order=['name', 'type', 'creator', 'downloads', 'updated_at'],
+                column_config={'name': "Model", 'type': "Type", 'creator': "Creator", 'downloads': "Downloads", 'updated_at': "Updated"},
+                hide_index=True
+            )
+            models = None
+        else:
+            query = ('query', normalize_query(st.session_state['model_name']))
+            models = get_store().get(query, session_id())
+            if models is None and (models := get_models_infos(st.session_state['model_name'])) is not None:
+                models = {'items': [compact_model(model, get_store().blobs) for model in models['items']], 'fetched_at': time.time()}
+                get_store().put(query, models, session_id())
+
+        if models is not None and len(models['items']) == 0:
+            st.error(f"{st.session_state['model_name']} seem to not exist on Civitai.")
+        elif models is not None:
+            models = watched_models(models)
+
+            nb_models = len(models['items'])
+            st.success(f"Found {nb_models} model{'s' if nb_models > 1 else ''}")
+
+            st.download_button(
+                "Workflows of every loaded version",
+                data=partial(get_workflow_bundle, models['items']),
+                file_name=f"workflows_{normalize_query(st.session_state['model_name']).replace(' ', '_')}.zip",
+                mime="application/zip",
+                key="bundle_query",
+                on_click="ignore",
+                icon="📦"
             )
-            st.markdown(infos_str, unsafe_allow_html=True)
 
-            m_1, m_2, m_3, m_4 = st.columns(4)
+            prefetch_images(models)
+
+            for model in models['items']:
+                render_model(model)
 
-            m_1.metric(label="📥 Download", value=model['stats'].get('downloadCount'), delta='')
-            m_2.metric(label="👍 Likes", value=model['stats'].get('thumbsUpCount'))
-            m_3.metric(label="👎 Unlikes", value=model['stats'].get('thumbsDownCount'))
-            m_4.metric(label="💬 Comments", value=model['stats'].get('commentCount'))
-            style_metric_cards(
-                border_left_color="#FF4B4B",
-            )
-            
-            st.write("##### Versions")
-            for version in model['modelVersions']:
-                if version['id'] not in model:
-                    model[version['id']] = get_images(version_id=version['id'], model_id=model['id'])
-                    st.session_state['models'][st.session_state['model_name']] = models
-                
-
-                with st.expander(f"{version['name']}", ):    
-                    nb_images = 0
-                    if model[version['id']]:
-                        nb_images = len(model[version['id']]['items'])
-                    st.markdown(f"Download: [{version['id']}]({version['downloadUrl']})<br>Images: {nb_images}", unsafe_allow_html=True)
-
-                    st.subheader("Stats", divider="blue")
-                    
-                    if model[version['id']]:
-                        _, col_2, _ = st.columns(3)
-                        with col_2:
-                            data_sampler = get_data_sampler(model[version['id']])
-                            data = alt.Chart(data_sampler).mark_arc().encode(
-                                theta="count",              
-                                color="sampler",
-                                tooltip=["sampler", "count"],
-                            )
-                            st.altair_chart(
-                                data, 
-                                use_container_width=False
-                            )
-                        col_1, col_2 = st.columns(2)
-                        with col_1:
-                            data_steps = get_data_steps(model[version['id']])
-                            samplers = {
-                                'samplers': [],
-                                'group': [],
-                                'steps': [],
-                            }
-                            for sp in data_steps:
-                                samplers['samplers'].append(sp)
-                                samplers['samplers'].append(sp)
-                                samplers['samplers'].append(sp)
-                                samplers['group'].append('min')
-                                samplers['group'].append('mean')
-                                samplers['group'].append('max')
-                                samplers['steps'].append(pd.Series(data_steps[sp]).min())
-                                samplers['steps'].append(pd.Series(data_steps[sp]).mean())
-                                samplers['steps'].append(pd.Series(data_steps[sp]).max())
-                            
-                            samplers = pd.DataFrame(
-                                samplers,
-                                columns=['samplers', 'group', 'steps']                
-                            )
-
-                            data = alt.Chart(samplers).mark_bar().encode(
-                                x="samplers:N",
-                                y="steps:Q",
-                                xOffset="group:N",
-                                color='group:N',
-                            )
-                            st.altair_chart(
-                                data, 
-                                use_container_width=True,
-                                theme="streamlit"
-                            )
-                        with col_2:
-                            data_CFG = get_data_CFG(model[version['id']])
-                            samplers = {
-                                'samplers': [],
-                                'group': [],
-                                'CFG': [],
-                            }
-                            for sp in data_CFG:
-                                samplers['samplers'].append(sp)
-                                samplers['samplers'].append(sp)
-                                samplers['samplers'].append(sp)
-                                samplers['group'].append('min')
-                                samplers['group'].append('mean')
-                                samplers['group'].append('max')
-                                samplers['CFG'].append(pd.Series(data_CFG[sp]).min())
-                                samplers['CFG'].append(pd.Series(data_CFG[sp]).mean())
-                                samplers['CFG'].append(pd.Series(data_CFG[sp]).max())
-                            
-                            samplers = pd.DataFrame(
-                                samplers,
-                                columns=['samplers', 'group', 'CFG'],
-                    
-                            )
-
-                            data = alt.Chart(samplers).mark_bar().encode(
-                                x="samplers:N",
-                                y="CFG:Q",
-                                xOffset="group:N",
-                                color='group:N',
-                            )
-                            st.altair_chart(
-                                data, 
-                                use_container_width=True,
-                                theme="streamlit"
-                            )
-
-                        st.subheader(f"Images / {len(model[version['id']]['items'])}", divider="blue")
-
-                        col_1, col_2, col_3, col_4 = st.columns(4)
-                        i = 1
-                        for img in model[version['id']]['items']:
-                            if i == 1:
-                                col_1.image(img['url'])
-                                c_1, c_2, c_3 = col_1.columns(3, gap='small')
-                                with c_1.popover("ℹ️", use_container_width=True):
-                                    popover_image_metadata(image=img, version_id=version['id'])
-                                data = ''
-                                disabled = True
-                                if meta:= img.get('meta'):
-                                    if comfy:= meta.get('comfy'):
-                                        if isinstance(comfy, str):
-                                            data_json = json.loads(comfy)
-                                        data = json.dumps(data_json.get('workflow'), indent=4)
-                                        disabled = False
-                                        
-                                c_2.download_button(
-                                    label="WF",
-                                    data = data,
-                                    mime="text/json",
-                                    key=f"nodes_{img['id']}_{version['id']}", 
-                                    file_name=f"wf_{img['id']}.json",
-                                    use_container_width=True,
-                                    disabled=disabled
-                                )
-                                c_3.link_button("📷", f"https://civitai.com/images/{img['id']}", use_container_width=True)
-                            if i == 2:
-                                col_2.image(img['url'])
-                                c_1, c_2, c_3 = col_2.columns(3, gap='small')
-                                with c_1.popover("ℹ️", use_container_width=True):
-                                    popover_image_metadata(image=img, version_id=version['id'])
-                                data = ''
-                                disabled = True
-                                if meta:= img.get('meta'):
-                                    if comfy:= meta.get('comfy'):
-                                        if isinstance(comfy, str):
-                                            data_json = json.loads(comfy)
-                                        data = json.dumps(data_json.get('workflow'), indent=4)
-                                        disabled = False
-                                        
-                                c_2.download_button(
-                                    label="WF",
-                                    data = data,
-                                    mime="text/json",
-                                    key=f"nodes_{img['id']}_{version['id']}", 
-                                    file_name=f"wf_{img['id']}.json",
-                                    use_container_width=True,
-                                    disabled=disabled
-                                )
-                                c_3.link_button("📷", f"https://civitai.com/images/{img['id']}", use_container_width=True)
-                            if i == 3:
-                                col_3.image(img['url'])
-                                c_1, c_2, c_3 = col_3.columns(3, gap='small')
-                                with c_1.popover("ℹ️", use_container_width=True):
-                                    popover_image_metadata(image=img, version_id=version['id'])
-                                data = ''
-                                disabled = True
-                                if meta:= img.get('meta'):
-                                    if comfy:= meta.get('comfy'):
-                                        if isinstance(comfy, str):
-                                            data_json = json.loads(comfy)
-                                        data = json.dumps(data_json.get('workflow'), indent=4)
-                                        disabled = False
-                                        
-                                c_2.download_button(
-                                    label="WF",
-                                    data = data,
-                                    mime="text/json",
-                                    key=f"nodes_{img['id']}_{version['id']}", 
-                                    file_name=f"wf_{img['id']}.json",
-                                    use_container_width=True,
-                                    disabled=disabled
-                                )
-                                c_3.link_button("📷", f"https://civitai.com/images/{img['id']}", use_container_width=True)
-                            if i == 4:
-                                col_4.image(img['url'])
-                                c_1, c_2, c_3 = col_4.columns(3, gap='small')
-                                with c_1.popover("ℹ️", use_container_width=True):
-                                    popover_image_metadata(image=img, version_id=version['id'])
-                                data = ''
-                                disabled = True
-                                if meta:= img.get('meta'):
-                                    if comfy:= meta.get('comfy'):
-                                        if isinstance(comfy, str):
-                                            data_json = json.loads(comfy)
-                                        data = json.dumps(data_json.get('workflow'), indent=4)
-                                        disabled = False
-                                        
-                                c_2.download_button(
-                                    label="WF",
-                                    data = data,
-                                    mime="text/json",
-                                    key=f"nodes_{img['id']}_{version['id']}", 
-                                    file_name=f"wf_{img['id']}.json",
-                                    use_container_width=True,
-                                    disabled=disabled
-                                )
-                                c_3.link_button("📷", f"https://civitai.com/images/{img['id']}", use_container_width=True)
-                            i += 1
-                            if i > 4:
-                                i = 1
-            with st.expander("Description"):
-                st.markdown(model['description'], unsafe_allow_html=True)
-
-
-else:
-    st.write("Indicate model name")
 
+    else:
+        st.write("Indicate model name")
+finally:
+    # the profile is stopped even when the script raises or is stopped
+    render_debug(*stop_profiling(profiler, tracing))
@@ -0,0 +1 @@
+'''Civitai models viewer helpers shared by the Streamlit app'''
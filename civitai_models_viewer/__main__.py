@@ -0,0 +1,86 @@
+import argparse
+import json
+import sys
+
+from .bench import IMAGES_SCALES, MockCivitai, MockConfig, bench
+from .catalog import ModelCatalog, sync
+from .config import CATALOG_PATH, MAX_WORKERS
+from .export import export
+
+def main() -> None:
+    '''command line entry point: python -m civitai_models_viewer'''
+    parser = argparse.ArgumentParser(prog='civitai_models_viewer')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='stream models, versions and images metadata to a file')
+    export_parser.add_argument('models', nargs='+', help='model names or ids')
+    export_parser.add_argument('-o', '--output', required=True, help='JSON lines file or parquet directory')
+    export_parser.add_argument('-f', '--format', choices=['jsonl', 'parquet'], default='jsonl')
+    export_parser.add_argument('-w', '--workers', type=int, default=MAX_WORKERS, help='versions fetched concurrently')
+    export_parser.add_argument('--checkpoint', help='checkpoint file, default to output with .checkpoint suffix')
+    export_parser.add_argument('--max-images', type=int, default=sys.maxsize, help='images per version')
+
+    sync_parser = commands.add_parser('sync', help='sync the local models catalog, in full then incrementally')
+    sync_parser.add_argument('--catalog', default=CATALOG_PATH, help='catalog database')
+
+    mock_options = argparse.ArgumentParser(add_help=False)
+    mock_options.add_argument('--latency', type=float, default=MockConfig.latency, help='seconds per response')
+    mock_options.add_argument('--page-size', type=int, default=MockConfig.page_size, help='images per page at most')
+    mock_options.add_argument('--models', type=int, default=MockConfig.models, help='models per query')
+    mock_options.add_argument('--versions', type=int, default=MockConfig.versions, help='versions per model')
+    mock_options.add_argument('--comfy-bytes', type=int, default=MockConfig.comfy_bytes, help='size of comfy workflows')
+    mock_options.add_argument('--recorded', help='response cache database to replay instead of synthetic payloads')
+    mock_options.add_argument('--throttle', type=float, default=MockConfig.throttle, help='share of requests answered 429')
+    mock_options.add_argument('--retry-after', type=float, default=MockConfig.retry_after, help='Retry-After of 429 answers, in seconds')
+
+    bench_parser = commands.add_parser('bench', parents=[mock_options], help='benchmark the app against a local mock API')
+    bench_parser.add_argument('--images', type=int, nargs='+', default=list(IMAGES_SCALES), help='images per version, one scenario each')
+    bench_parser.add_argument('--query', default='synthetic', help='model name searched')
+    bench_parser.add_argument('--rate', type=float, help='override the API rate limit, requests per second')
+    bench_parser.add_argument('-o', '--output', help='JSON results file, default to stdout')
+
+    mock_parser = commands.add_parser('mock', parents=[mock_options], help='serve the mock API, e.g. to profile the UI')
+    mock_parser.add_argument('--images', type=int, default=MockConfig.images, help='images per version')
+    mock_parser.add_argument('--port', type=int, default=8765)
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        written = export(
+            args.models,
+            output=args.output,
+            output_format=args.format,
+            workers=args.workers,
+            checkpoint_path=args.checkpoint,
+            max_images=args.max_images
+        )
+        print(f"{written} images exported to {args.output}", file=sys.stderr)
+    elif args.command == 'sync':
+        catalog = ModelCatalog(args.catalog)
+        changed = sync(catalog)
+        print(f"{changed} models new or updated, {len(catalog)} in {args.catalog}", file=sys.stderr)
+    elif args.command in ('bench', 'mock'):
+        config = MockConfig(
+            latency=args.latency,
+            page_size=args.page_size,
+            models=args.models,
+            versions=args.versions,
+            comfy_bytes=args.comfy_bytes,
+            recorded=args.recorded,
+            throttle=args.throttle,
+            retry_after=args.retry_after
+        )
+        if args.command == 'mock':
+            config.images = args.images
+            mock = MockCivitai(config, port=args.port)
+            print(f"serving CIVITAI_API_URL={mock.api_url}", file=sys.stderr)
+            mock.server.serve_forever()
+        else:
+            results = json.dumps(bench(tuple(args.images), config, model_name=args.query, rate=args.rate), indent=2)
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as f:
+                    f.write(results + '\n')
+            else:
+                print(results)
+
+if __name__ == '__main__':
+    main()
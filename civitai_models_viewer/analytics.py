@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .export import PARTITIONS, flatten
+
+SCHEMA = pa.schema([
+    ('model_id', pa.int64()),
+    ('model_name', pa.string()),
+    ('version_id', pa.int64()),
+    ('version_name', pa.string()),
+    ('base_model', pa.string()),
+    ('image_id', pa.int64()),
+    ('width', pa.int64()),
+    ('height', pa.int64()),
+    ('sampler', pa.string()),
+    ('steps', pa.int64()),
+    ('cfg_scale', pa.float64()),
+    ('clip_skip', pa.int64()),
+    ('model_hash', pa.string()),
+])
+FILE_SCHEMA = pa.schema([field for field in SCHEMA if field.name not in PARTITIONS])
+PARTITIONING = ds.partitioning(pa.schema([SCHEMA.field(name) for name in PARTITIONS]), flavor='hive')
+
+# parts written to a version before they are merged into one file
+MAX_PARTS = 16
+
+# name column labelling each id column compared
+LABELS = {'model_id': 'model_name', 'version_id': 'version_name'}
+
+@dataclass
+class Comparison:
+    '''aggregates of image metadata per model or version, shaped for the charts
+
+    Each frame has the id of its group and a unique label to display.
+    '''
+    images: pd.DataFrame
+    samplers: pd.DataFrame
+    steps: pd.DataFrame
+    cfg: pd.DataFrame
+    resolutions: pd.DataFrame
+    base_models: pd.DataFrame
+
+class ImageMetaStore:
+    '''append-only parquet dataset of image metadata, partitioned by model and version
+
+    Each ingested page is appended as a part file. Parts of a version are merged once
+    they pile up, and images fetched again are deduplicated when read.
+    '''
+
+    def __init__(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def _directory(self, model_id: int, version_id: int) -> str:
+        return os.path.join(self.path, f"model_id={model_id}", f"version_id={version_id}")
+
+    def append(self, model: dict, version: dict, items: list) -> None:
+        '''append a page of images of a version'''
+        if not items:
+            return
+        records = [flatten(model, version, img) for img in items]
+        table = pa.Table.from_pylist(
+            [{field.name: record[field.name] for field in FILE_SCHEMA} for record in records],
+            schema=FILE_SCHEMA
+        )
+        directory = self._directory(model['id'], version['id'])
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            pq.write_table(table, os.path.join(directory, f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet"))
+            parts = [name for name in os.listdir(directory) if name.endswith('.parquet')]
+            if len(parts) > MAX_PARTS:
+                self._merge(directory, parts)
+            self.generation += 1
+
+    def _merge(self, directory: str, parts: list) -> None:
+        '''rewrite the parts of a version as one file, last copy of each image kept'''
+        table = pa.concat_tables(
+            pq.read_table(os.path.join(directory, name), schema=FILE_SCHEMA) for name in sorted(parts)
+        )
+        frame = table.to_pandas().drop_duplicates('image_id', keep='last')
+        merged = os.path.join(directory, f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet")
+        pq.write_table(pa.Table.from_pandas(frame, schema=FILE_SCHEMA, preserve_index=False), merged)
+        for name in parts:
+            os.remove(os.path.join(directory, name))
+
+    def frame(self, model_ids: list | None = None, columns: list | None = None) -> pd.DataFrame:
+        '''image metadata of the models, every model without ids, one row per image'''
+        with self._lock:
+            dataset = ds.dataset(self.path, schema=SCHEMA, format='parquet', partitioning=PARTITIONING)
+            table = dataset.to_table(
+                columns=columns and list(dict.fromkeys(['image_id', *columns])),
+                filter=ds.field('model_id').isin(model_ids) if model_ids else None
+            )
+        return table.to_pandas().drop_duplicates('image_id', keep='last')
+
+    def versions(self) -> pd.DataFrame:
+        '''models and versions stored, with their number of images'''
+        frame = self.frame(columns=['model_id', 'model_name', 'version_id', 'version_name'])
+        return frame.groupby(['model_id', 'model_name', 'version_id', 'version_name'], dropna=False).size().reset_index(name='images')
+
+def _shares(frame: pd.DataFrame, group: str, columns: str | list[str]) -> pd.DataFrame:
+    '''number and share of images per group and value of columns'''
+    counts = frame.groupby([group, *([columns] if isinstance(columns, str) else columns)]).size().reset_index(name='count')
+    counts['share'] = counts['count'] / counts.groupby(group)['count'].transform('sum')
+    return counts
+
+def _quantiles(frame: pd.DataFrame, group: str, column: str) -> pd.DataFrame:
+    '''min, quartiles, median and max of a column per group'''
+    grouped = frame.dropna(subset=[column]).groupby(group)[column]
+    return pd.DataFrame({
+        'min': grouped.min(),
+        'p25': grouped.quantile(0.25),
+        'median': grouped.median(),
+        'mean': grouped.mean(),
+        'p75': grouped.quantile(0.75),
+        'max': grouped.max(),
+    }).reset_index()
+
+def _labels(frame: pd.DataFrame, group: str) -> pd.Series:
+    '''name of each id of the group, suffixed by the id when several ids share it'''
+    names = frame.groupby(group)[LABELS[group]].last().fillna('')
+    shared = names.duplicated(keep=False)
+    names[shared] = names[shared] + ' #' + names.index[shared].astype(str)
+    return names
+
+def compare(frame: pd.DataFrame, group: str = 'model_id', top: int = 10) -> Comparison:
+    '''compare samplers, steps, CFG, resolutions and base models across models or versions by id
+
+    Names only label the groups: models or versions sharing a name are kept apart.
+    '''
+    sized = frame.dropna(subset=['width', 'height']).astype({'width': 'int64', 'height': 'int64'})
+    resolutions = _shares(sized, group, ['width', 'height'])
+    resolutions = resolutions[resolutions.groupby(group)['count'].rank(method='first', ascending=False) <= top]
+    # labels formatted once per distinct resolution, not per image
+    resolutions.insert(1, 'resolution', resolutions['width'].astype(str) + 'x' + resolutions['height'].astype(str))
+    comparison = Comparison(
+        images=frame.groupby(group).size().reset_index(name='images'),
+        samplers=_shares(frame.dropna(subset=['sampler']), group, 'sampler'),
+        steps=_quantiles(frame, group, 'steps'),
+        cfg=_quantiles(frame, group, 'cfg_scale'),
+        resolutions=resolutions,
+        base_models=_shares(frame.dropna(subset=['base_model']), group, 'base_model'),
+    )
+    labels = _labels(frame, group)
+    for aggregates in vars(comparison).values():
+        aggregates.insert(1, 'label', aggregates[group].map(labels))
+    return comparison
@@ -0,0 +1,170 @@
+import json
+import time
+from collections.abc import Iterator
+from functools import cache
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .blobs import BlobStore
+from .cache import ResponseCache
+from .config import (
+    API_URL, CACHE_MAX_BYTES, CACHE_PATH, CACHE_TTL, CIVITAI_TOKEN, CONNECT_TIMEOUT, IMAGES_MAX,
+    IMAGES_MAX_BYTES, IMAGES_MAX_SECONDS, IMAGES_PAGE_SIZE, MAX_RETRIES, MAX_WORKERS, RATE_BURST,
+    RATE_LIMIT, READ_TIMEOUT
+)
+from .ingest import ingest_images_page
+from .metrics import METRICS
+from .scheduler import RequestScheduler
+
+@cache
+def get_session() -> requests.Session:
+    '''pooled HTTP session shared by every request'''
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {CIVITAI_TOKEN}"
+    })
+    return session
+
+@cache
+def get_scheduler() -> RequestScheduler:
+    '''rate limited, retrying and coalescing gate of every API request'''
+    return RequestScheduler(
+        get_session(),
+        rate=RATE_LIMIT,
+        burst=RATE_BURST,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        max_retries=MAX_RETRIES
+    )
+
+@cache
+def get_cache() -> ResponseCache:
+    '''disk cache of API responses shared by every session'''
+    return ResponseCache(CACHE_PATH, max_bytes=CACHE_MAX_BYTES)
+
+def fetch_raw(endpoint: str, params: str = '', store: bool = True, revalidate: bool = False) -> bytes:
+    '''get raw body from civitai API, answered by the cache while fresh and revalidated once stale
+
+    Bulk listings pass store=False so they do not evict the responses the UI needs, and the
+    refresher revalidate=True to check the upstream even while fresh.
+    '''
+    url = f"{API_URL}{endpoint}?{params}" if params else f"{API_URL}{endpoint}"
+    resource = endpoint.split('/')[0]
+    ttl = CACHE_TTL[resource]
+    cache = get_cache()
+    cached = cache.get(url) if store else None
+    if cached and cached.fresh and not revalidate:
+        METRICS.count('civitai_cache_requests_total', endpoint=resource, result='hit')
+        METRICS.count('civitai_payload_bytes_total', len(cached.body), endpoint=resource, source='cache')
+        return cached.body
+    with METRICS.timed('civitai_api_request_seconds', endpoint=resource):
+        response = get_scheduler().get(url, headers=cached.validators() if cached else None)
+    if cached and response.status_code == 304:
+        METRICS.count('civitai_cache_requests_total', endpoint=resource, result='revalidated')
+        METRICS.count('civitai_payload_bytes_total', len(cached.body), endpoint=resource, source='cache')
+        cache.refresh(url, ttl=ttl)
+        return cached.body
+    METRICS.count('civitai_cache_requests_total', endpoint=resource, result='miss')
+    response.raise_for_status()
+    METRICS.count('civitai_payload_bytes_total', len(response.content), endpoint=resource, source='upstream')
+    if store:
+        cache.put(
+            url,
+            response.content,
+            ttl=ttl,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified')
+        )
+    return response.content
+
+def parse_json(body: bytes) -> dict:
+    '''parse API body, invalid json raised as a request error'''
+    try:
+        return json.loads(body)
+    except ValueError as e:
+        raise requests.exceptions.InvalidJSONError(e)
+
+def ingest_json(body: bytes, blobs: BlobStore) -> dict:
+    '''parse images page body into lean records, invalid json raised as a request error'''
+    try:
+        return ingest_images_page(body, blobs)
+    except (ValueError, KeyError, TypeError) as e:
+        raise requests.exceptions.InvalidJSONError(e)
+
+def listing_page(page: dict) -> dict:
+    '''page of a listing endpoint, a body without items raised as a request error'''
+    if not isinstance(page, dict) or not isinstance(page.get('items'), list):
+        raise requests.exceptions.InvalidJSONError(f"listing page without items: {str(page)[:200]}")
+    page.setdefault('metadata', {})
+    return page
+
+def fetch_json(endpoint: str, params: str = '', revalidate: bool = False) -> dict:
+    '''get json from civitai API'''
+    return parse_json(fetch_raw(endpoint, params, revalidate=revalidate))
+
+def get_models(model_name: str) -> dict:
+    '''get models matching name from civitai'''
+    return fetch_json('models', f"query={quote(model_name)}")
+
+def get_model(model_id: int, revalidate: bool = False) -> dict:
+    '''get model from civitai by id'''
+    return fetch_json(f"models/{model_id}", revalidate=revalidate)
+
+def iter_model_pages(cursor: str | None = None, limit: int = 100) -> Iterator[dict]:
+    '''follow the cursors of the whole models listing, newest first, without caching the pages'''
+    params = f"limit={limit}&sort=Newest"
+    while True:
+        body = fetch_raw('models', f"{params}&cursor={quote(str(cursor))}" if cursor else params, store=False)
+        with METRICS.timed('civitai_json_parse_seconds', endpoint='models'):
+            page = listing_page(parse_json(body))
+        yield page
+        cursor = page['metadata'].get('nextCursor')
+        if not cursor or not page['items']:
+            return
+
+def iter_image_pages(
+        version_id: int,
+        model_id: int,
+        max_images: int = IMAGES_MAX,
+        max_bytes: int = IMAGES_MAX_BYTES,
+        max_seconds: float = IMAGES_MAX_SECONDS,
+        cursor: str | None = None,
+        blobs: BlobStore | None = None,
+        store: bool = True,
+        revalidate: bool = False
+    ) -> Iterator[dict]:
+    '''follow images cursors lazily, yield pages until the last one or a ceiling is reached
+
+    The last page yielded is flagged `truncated` in its metadata when a ceiling was reached.
+    A cursor resumes the images where a previous iteration stopped. With a blob store, pages
+    are parsed item by item into lean records, their workflows and raw items spilled to it.
+    Bulk crawls pass store=False to keep the pages out of the response cache, the refresher
+    revalidate=True to check them upstream even while fresh.
+    '''
+    params = f"limit={IMAGES_PAGE_SIZE}&modelVersionId={version_id}&modelId={model_id}"
+    nb_images = 0
+    nb_bytes = 0
+    start = time.monotonic()
+    while True:
+        body = fetch_raw('images', f"{params}&cursor={quote(str(cursor))}" if cursor else params, store=store, revalidate=revalidate)
+        nb_bytes += len(body)
+        with METRICS.timed('civitai_json_parse_seconds', endpoint='images'):
+            page = listing_page(parse_json(body) if blobs is None else ingest_json(body, blobs))
+        # the page is not held as bytes while its records are consumed
+        del body
+        cursor = page['metadata'].get('nextCursor')
+        truncated = len(page['items']) > max_images - nb_images
+        page['items'] = page['items'][:max_images - nb_images]
+        nb_images += len(page['items'])
+        METRICS.count('civitai_images_total', len(page['items']))
+        ceiling = truncated or nb_images >= max_images or nb_bytes >= max_bytes or time.monotonic() - start >= max_seconds
+        if ceiling and (cursor or truncated):
+            page['metadata']['truncated'] = True
+        yield page
+        if not cursor or ceiling:
+            return
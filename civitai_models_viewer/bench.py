@@ -0,0 +1,304 @@
+import json
+import math
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from .cache import ResponseCache
+
+APP_PATH = Path(__file__).resolve().parent.parent / 'app.py'
+IMAGES_SCALES = (10, 200, 2000, 20000)
+RECORDED_API_URL = 'https://civitai.com/api/v1/'
+SAMPLERS = ('Euler a', 'Euler', 'DPM++ 2M Karras', 'DPM++ SDE Karras', 'DDIM', 'UniPC')
+BASE_MODELS = ('SD 1.5', 'SDXL 1.0', 'Pony', 'Flux.1 D')
+
+@dataclass
+class MockConfig:
+    '''shape and pace of the synthetic API
+
+    A throttle answers that share of the requests, evenly spread from the first one,
+    with a 429 and a Retry-After of retry_after seconds, or none when it is None.
+    '''
+    latency: float = 0.05
+    page_size: int = 200
+    models: int = 1
+    versions: int = 3
+    images: int = 200
+    comfy_bytes: int = 4096
+    recorded: str | None = None
+    throttle: float = 0.0
+    retry_after: float | None = 1.0
+
+def synthetic_model(model_id: int, versions: int) -> dict:
+    '''model payload shaped like /models items'''
+    return {
+        'id': model_id,
+        'name': f"Synthetic model {model_id}",
+        'type': 'LORA',
+        'nsfw': False,
+        'tags': ['synthetic', 'benchmark'],
+        'description': f"<p>Synthetic model {model_id} served by the benchmark API.</p>" * 20,
+        'creator': {'username': f"creator_{model_id}", 'image': None},
+        'stats': {'downloadCount': 1000 * model_id, 'thumbsUpCount': 100, 'thumbsDownCount': 1, 'commentCount': 10},
+        'modelVersions': [
+            {
+                'id': model_id * 1000 + v,
+                'name': f"v{v + 1}.0",
+                'baseModel': BASE_MODELS[v % len(BASE_MODELS)],
+                'downloadUrl': f"https://civitai.com/api/download/models/{model_id * 1000 + v}",
+                'updatedAt': '2024-01-01T00:00:00.000Z',
+            }
+            for v in range(versions)
+        ],
+    }
+
+def synthetic_image(version_id: int, n: int, comfy_bytes: int) -> dict:
+    '''image payload shaped like /images items, deterministic for a version and rank'''
+    rand = random.Random(version_id * 1_000_003 + n)
+    meta = {
+        'prompt': f"masterpiece, best quality, <lora:synthetic_{version_id}:0.8>, subject {rand.randint(0, 500)}, "
+                  + ', '.join(rand.choices(['portrait', 'landscape', 'night', 'city', 'forest', 'neon', 'film grain'], k=5)),
+        'negativePrompt': 'lowres, bad anatomy, worst quality',
+        'seed': rand.randint(0, 2**32),
+        'steps': rand.choice([20, 25, 28, 30, 40]),
+        'cfgScale': rand.choice([3.5, 5, 6, 7, 7.5]),
+        'sampler': rand.choice(SAMPLERS),
+        'Model': f"synthetic_{version_id}",
+        'Model hash': f"{version_id:010x}",
+        'Clip skip': rand.choice([1, 2]),
+        'Size': '832x1216',
+    }
+    if comfy_bytes and n % 3 == 0:
+        meta['comfy'] = json.dumps({
+            'prompt': {'3': {'class_type': 'KSampler', 'inputs': {'seed': meta['seed'], 'steps': meta['steps']}}},
+            'workflow': {'nodes': [{'id': 3, 'type': 'KSampler'}], 'extra': 'x' * comfy_bytes},
+        })
+    return {
+        'id': version_id * 1_000_000 + n,
+        'url': f"https://image.civitai.com/synthetic/{version_id}/{n}.jpeg",
+        'width': 832,
+        'height': 1216,
+        'username': f"user_{rand.randint(0, 200)}",
+        'nsfw': False,
+        'nsfwLevel': 'None',
+        'createdAt': '2024-01-01T00:00:00.000Z',
+        'meta': meta if n % 7 else None,
+    }
+
+class MockCivitai:
+    '''local Civitai API serving recorded or synthetic /models and /images responses
+
+    Recorded responses are read from a response cache database filled against civitai.com.
+    '''
+
+    def __init__(self, config: MockConfig, port: int = 0) -> None:
+        self.config = config
+        self.calls: dict[str, int] = {}
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self._recorded = None
+        if config.recorded:
+            self._recorded = ResponseCache(config.recorded, max_bytes=sys.maxsize)
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/api/v1/"
+
+    def start(self) -> 'MockCivitai':
+        threading.Thread(target=self.server.serve_forever, daemon=True, name='mock_civitai').start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, target: str) -> dict | bytes | None:
+        '''body answering a request target (path and query), None when not found'''
+        if self._recorded:
+            cached = self._recorded.get(RECORDED_API_URL.removesuffix('/api/v1/') + target)
+            return cached.body if cached else None
+        config = self.config
+        parts = urlsplit(target)
+        endpoint = parts.path.removeprefix('/api/v1/')
+        query = parse_qs(parts.query)
+        if endpoint == 'models':
+            return {
+                'items': [synthetic_model(i, config.versions) for i in range(1, config.models + 1)],
+                'metadata': {'totalItems': config.models, 'currentPage': 1, 'totalPages': 1},
+            }
+        if endpoint.startswith('models/'):
+            model_id = int(endpoint.split('/')[1])
+            return synthetic_model(model_id, config.versions) if 0 < model_id <= config.models else None
+        if endpoint == 'images':
+            version_id = int(query['modelVersionId'][0])
+            limit = min(int(query.get('limit', ['100'])[0]), config.page_size)
+            start = int(query.get('cursor', ['0'])[0])
+            stop = min(start + limit, config.images)
+            metadata = {}
+            if stop < config.images:
+                metadata['nextCursor'] = str(stop)
+            return {'items': [synthetic_image(version_id, n, config.comfy_bytes) for n in range(start, stop)], 'metadata': metadata}
+        return None
+
+    def _handler(self) -> type:
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                path = urlsplit(self.path).path
+                with mock._lock:
+                    mock.calls[path] = mock.calls.get(path, 0) + 1
+                    nb_calls = sum(mock.calls.values())
+                    throttled = math.ceil(nb_calls * mock.config.throttle) != math.ceil((nb_calls - 1) * mock.config.throttle)
+                    mock.throttled += throttled
+                time.sleep(mock.config.latency)
+                if throttled:
+                    self.send_response(429)
+                    if mock.config.retry_after is not None:
+                        self.send_header('Retry-After', f"{mock.config.retry_after:g}")
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = mock.respond(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+def peak_rss() -> int:
+    '''peak resident set size of this process, in bytes'''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def run_scenario(app_path: str, model_name: str, timeout: float) -> dict:
+    '''drive the app headlessly: search the model, then open every version'''
+    from streamlit.testing.v1 import AppTest
+
+    from .api import get_models
+    from .metrics import METRICS
+
+    at = AppTest.from_file(app_path, default_timeout=timeout)
+    at.run()
+    at.text_input(key='input_model_name').input(model_name)
+    start = time.perf_counter()
+    at.run()
+    first_render = time.perf_counter() - start
+
+    versions = [version['id'] for model in get_models(model_name)['items'] for version in model['modelVersions']]
+    for version_id in versions:
+        at.session_state[f"version_{version_id}"] = True
+    start = time.perf_counter()
+    at.run()
+    full_render = time.perf_counter() - start
+
+    stages = {}
+    for row in METRICS.summary():
+        if 'mean' in row:
+            name = f"{row['metric'].removeprefix('civitai_').removesuffix('_seconds')}[{row['labels']}]"
+            stages[name] = {
+                'count': row['count'],
+                'total': row['mean'] * row['count'] if row['count'] else 0.0,
+                'p50': row['p50'],
+                'p95': row['p95'],
+            }
+    return {
+        'time_to_first_render': first_render,
+        'full_page_render': full_render,
+        'peak_rss': peak_rss(),
+        'versions': len(versions),
+        'cache_hit_ratio': METRICS.ratio('civitai_cache_requests_total', 'result', 'hit'),
+        'stages': stages,
+        'exceptions': [str(e.value) for e in at.exception],
+    }
+
+def bench(
+        images: tuple = IMAGES_SCALES,
+        config: MockConfig | None = None,
+        app_path: str | os.PathLike = APP_PATH,
+        model_name: str = 'synthetic',
+        rate: float | None = None,
+        timeout: float = 1800
+    ) -> dict:
+    '''run one cold-cache scenario per images count, each in a fresh interpreter, against the mock API'''
+    config = config or MockConfig()
+    results = []
+    for nb_images in images:
+        scenario = MockConfig(**{**asdict(config), 'images': nb_images})
+        mock = MockCivitai(scenario).start()
+        try:
+            with tempfile.TemporaryDirectory(prefix='civitai_bench_') as directory:
+                env = {
+                    **os.environ,
+                    'CIVITAI_API_URL': mock.api_url,
+                    'CIVITAI_CACHE_PATH': os.path.join(directory, 'civitai.sqlite'),
+                    'CIVITAI_SEARCH_PATH': os.path.join(directory, 'prompts.sqlite'),
+                    'CIVITAI_CATALOG_PATH': os.path.join(directory, 'catalog.sqlite'),
+                    'CIVITAI_ANALYTICS_PATH': os.path.join(directory, 'analytics'),
+                    'CIVITAI_CATALOG_SYNC_INTERVAL': '0',
+                    'CIVITAI_THUMBNAILS_PORT': '0',
+                    'CIVITAI_WATCHLIST': '',
+                    'CIVITAI_IMAGES_MAX': str(nb_images),
+                    'CIVITAI_IMAGES_MAX_BYTES': str(2**40),
+                    'CIVITAI_IMAGES_MAX_SECONDS': str(timeout),
+                    'CIVITAI_METRICS_PORT': '0',
+                }
+                if rate:
+                    env['CIVITAI_RATE_LIMIT'] = str(rate)
+                    env['CIVITAI_RATE_BURST'] = str(max(1, int(rate)))
+                process = subprocess.run(
+                    [sys.executable, '-m', __name__, str(app_path), model_name, str(timeout)],
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout * 2
+                )
+            if process.returncode:
+                result = {'error': process.stderr.strip().splitlines()[-1] if process.stderr.strip() else process.returncode}
+            else:
+                result = json.loads(process.stdout.strip().splitlines()[-1])
+            result = {'images_per_version': nb_images, **result, 'api_calls': sum(mock.calls.values()), 'throttled': mock.throttled, 'api_calls_by_path': mock.calls}
+        finally:
+            mock.stop()
+        results.append(result)
+        print(
+            f"{nb_images} images/version: first render {result.get('time_to_first_render', float('nan')):.2f}s, "
+            f"full page {result.get('full_page_render', float('nan')):.2f}s, "
+            f"peak RSS {result.get('peak_rss', 0) / 2**20:.0f} MB, {result['api_calls']} API calls",
+            file=sys.stderr
+        )
+
+    from importlib.metadata import version
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'streamlit': version('streamlit'),
+        'platform': platform.platform(),
+        'config': {**asdict(config), 'rate': rate},
+        'results': results,
+    }
+
+if __name__ == '__main__':
+    app, name, scenario_timeout = sys.argv[1:4]
+    print(json.dumps(run_scenario(app, name, float(scenario_timeout))))
@@ -0,0 +1,89 @@
+import os
+import tempfile
+import threading
+from bisect import bisect_right
+from collections.abc import Hashable
+
+class BlobStore:
+    '''append-only segment files of blobs addressed by (offset, length), kept out of the heap
+
+    Offsets run across segments: once the active segment holds a share of max_bytes, writes
+    go to a new one, and the oldest segments are dropped with their keys while the others
+    hold more than max_bytes. Segments are anonymous temporary files, in directory when given.
+    Blobs put under a key are written once: the reference of a known key is returned instead.
+    '''
+
+    def __init__(self, max_bytes: int | None = None, directory: str | None = None, segments: int = 8) -> None:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.segment_bytes = max(1, max_bytes // segments) if max_bytes else 64 * 1024 * 1024
+        self.reclaimed = 0
+        self._lock = threading.Lock()
+        self._size = 0
+        # start offset and file of each live segment, the active one last
+        self._starts = [0]
+        self._files = [tempfile.TemporaryFile(dir=directory)]
+        self._keys: dict[Hashable, tuple[int, int]] = {}
+
+    def put(self, data: bytes) -> tuple[int, int]:
+        '''append blob, return its offset and length'''
+        return self.put_many([data])[0]
+
+    def put_many(self, blobs: list[bytes], keys: list[Hashable] | None = None) -> list[tuple[int, int]]:
+        '''append blobs in one write, return their references, recorded under keys when given'''
+        data = b''.join(blobs)
+        with self._lock:
+            if self._size - self._starts[-1] >= self.segment_bytes:
+                self._rotate()
+            offset = self._size
+            os.pwrite(self._files[-1].fileno(), data, offset - self._starts[-1])
+            self._size += len(data)
+            refs = []
+            for blob in blobs:
+                refs.append((offset, len(blob)))
+                offset += len(blob)
+            if keys is not None:
+                self._keys.update(zip(keys, refs))
+        return refs
+
+    def _rotate(self) -> None:
+        '''start a new segment, then drop the oldest ones over budget and the keys in them'''
+        self._starts.append(self._size)
+        self._files.append(tempfile.TemporaryFile(dir=self.directory))
+        floor = self._starts[0]
+        while self.max_bytes and len(self._starts) > 1 and self._size - self._starts[0] > self.max_bytes:
+            self.reclaimed += self._starts[1] - self._starts[0]
+            self._starts.pop(0)
+            self._files.pop(0).close()
+        if self._starts[0] != floor:
+            self._keys = {key: ref for key, ref in self._keys.items() if ref[0] >= self._starts[0]}
+
+    def ref(self, key: Hashable) -> tuple[int, int] | None:
+        '''reference of the blob put under key, None if unknown or dropped'''
+        return self._keys.get(key)
+
+    @property
+    def floor(self) -> int:
+        '''offset of the oldest live blob: references below it were dropped'''
+        return self._starts[0]
+
+    def get(self, ref: tuple[int, int]) -> bytes:
+        '''read back blob of a reference, KeyError once dropped'''
+        offset, length = ref
+        # under the lock: a segment is not closed while read
+        with self._lock:
+            if offset < self._starts[0]:
+                raise KeyError(ref)
+            index = bisect_right(self._starts, offset) - 1
+            return os.pread(self._files[index].fileno(), length, offset - self._starts[index])
+
+    @property
+    def nbytes(self) -> int:
+        '''bytes held by the live segments'''
+        return self._size - self._starts[0]
+
+    def close(self) -> None:
+        for file in self._files:
+            file.close()
@@ -0,0 +1,80 @@
+import csv
+import hashlib
+import json
+import tempfile
+import zipfile
+from collections.abc import Callable, Iterable
+from typing import BinaryIO
+
+from .export import RECORD_FIELDS, flatten
+from .workflows import WorkflowIndex, workflow_of
+
+BUNDLE_FIELDS = [*RECORD_FIELDS, 'workflow']
+
+def canonical_workflow(blob: bytes) -> bytes | None:
+    '''workflow of a comfy blob as compact JSON with sorted keys, without the canvas position'''
+    if (workflow := workflow_of(blob)) is None:
+        return None
+    if isinstance(workflow.get('extra'), dict):
+        workflow['extra'] = {key: value for key, value in workflow['extra'].items() if key != 'ds'}
+    return json.dumps(workflow, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode()
+
+class WorkflowBundle:
+    '''ZIP of the workflows of images, each distinct workflow stored once, written entry by entry
+
+    The archive holds workflows/<hash>.json, a manifest.json mapping image ids to their
+    workflow file and a metadata.csv of prompts and generation parameters.
+    '''
+
+    def __init__(self, output: BinaryIO) -> None:
+        self._zip = zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6)
+        self._csv_file = tempfile.TemporaryFile('w+', encoding='utf-8', newline='')
+        self._csv = csv.DictWriter(self._csv_file, fieldnames=BUNDLE_FIELDS, extrasaction='ignore')
+        self._csv.writeheader()
+        self.images: dict[int, str] = {}
+        self.workflows: dict[str, int] = {}
+
+    def add(self, model: dict, version: dict, img: dict, blob: bytes | None) -> None:
+        '''add the workflow of an image unless an identical one is in the archive, and its metadata row'''
+        name = None
+        if blob and (workflow := canonical_workflow(blob)):
+            name = f"workflows/{hashlib.sha256(workflow).hexdigest()[:16]}.json"
+            if name not in self.workflows:
+                self._zip.writestr(name, json.dumps(json.loads(workflow), indent=4))
+                self.workflows[name] = 0
+            self.workflows[name] += 1
+            self.images[img['id']] = name
+        self._csv.writerow({**flatten(model, version, img), 'has_workflow': name is not None, 'workflow': name})
+
+    def close(self) -> None:
+        '''write manifest and metadata, then the central directory'''
+        self._zip.writestr('manifest.json', json.dumps({
+            'images': {str(image_id): name for image_id, name in self.images.items()},
+            'workflows': self.workflows,
+        }, indent=2))
+        self._csv_file.seek(0)
+        with self._zip.open('metadata.csv', 'w') as entry:
+            while chunk := self._csv_file.read(1 << 16):
+                entry.write(chunk.encode())
+        self._csv_file.close()
+        self._zip.close()
+
+def bundle_workflows(
+        images: Iterable[tuple[dict, dict, dict]],
+        workflows: WorkflowIndex,
+        raw_image: Callable[[dict], dict],
+        output: BinaryIO | None = None
+    ) -> BinaryIO:
+    '''ZIP of the workflows and metadata of (model, version, image) triples, rewound for reading
+
+    Metadata rows are built from the images as received, read back by raw_image.
+
+    Without output the archive is spooled to a temporary file once past a few megabytes.
+    '''
+    output = output or tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    bundle = WorkflowBundle(output)
+    for model, version, img in images:
+        bundle.add(model, version, raw_image(img), workflows.blob(img['id']))
+    bundle.close()
+    output.seek(0)
+    return output
@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+DROP INDEX IF EXISTS responses_last_access;
+-- covering index: eviction reads sizes in LRU order without walking the bodies
+CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access, size);
+CREATE TABLE IF NOT EXISTS total (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    size INTEGER NOT NULL
+);
+'''
+
+# running total of the body sizes, kept by triggers so puts do not sum the table
+TRIGGERS = '''
+CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN
+    UPDATE total SET size = size + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses BEGIN
+    UPDATE total SET size = size + new.size - old.size;
+END;
+CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN
+    UPDATE total SET size = size - old.size;
+END;
+'''
+
+def normalize_url(url: str) -> str:
+    '''normalize url to use it as cache key: lower case host, sorted query, no fragment'''
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+@dataclass
+class CachedResponse:
+    '''response body stored in cache with its validators'''
+    body: bytes
+    etag: str | None
+    last_modified: str | None
+    expires_at: float
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires_at > time.time()
+
+    def validators(self) -> dict:
+        '''conditional request headers to revalidate a stale entry'''
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+class ResponseCache:
+    '''SQLite response cache shared by threads and sessions, LRU evicted under a byte budget'''
+
+    def __init__(self, path: str, max_bytes: int) -> None:
+        if directory := os.path.dirname(path):
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            if self._conn.execute('SELECT 1 FROM total').fetchone() is None:
+                # caches created before the running total: summed once
+                self._conn.execute('INSERT INTO total SELECT 0, COALESCE(SUM(size), 0) FROM responses')
+            self._conn.execute('COMMIT')
+        self._conn.executescript(TRIGGERS)
+
+    def get(self, url: str) -> CachedResponse | None:
+        '''get cached response of url, fresh or not'''
+        key = normalize_url(url)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT body, etag, last_modified, expires_at FROM responses WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+        return CachedResponse(*row)
+
+    def put(self, url: str, body: bytes, ttl: int, etag: str | None = None, last_modified: str | None = None) -> None:
+        '''store response body of url for ttl seconds then evict least recently used entries'''
+        now = time.time()
+        with self._lock:
+            # an upsert, not a replace: replaced rows would not fire the delete trigger
+            self._conn.execute(
+                '''INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    body = excluded.body, size = excluded.size, etag = excluded.etag,
+                    last_modified = excluded.last_modified, expires_at = excluded.expires_at,
+                    last_access = excluded.last_access''',
+                (normalize_url(url), body, len(body), etag, last_modified, now + ttl, now)
+            )
+            self._evict()
+
+    def refresh(self, url: str, ttl: int) -> None:
+        '''extend an entry revalidated by the upstream (304 Not Modified)'''
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?',
+                (now + ttl, now, normalize_url(url))
+            )
+
+    def size(self) -> int:
+        '''total bytes of cached bodies'''
+        with self._lock:
+            return self._conn.execute('SELECT size FROM total').fetchone()[0]
+
+    def _evict(self) -> None:
+        total = self._conn.execute('SELECT size FROM total').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        rows = self._conn.execute('SELECT rowid, size FROM responses ORDER BY last_access')
+        for rowid, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((rowid,))
+            total -= size
+        rows.close()
+        self._conn.executemany('DELETE FROM responses WHERE rowid = ?', evicted)
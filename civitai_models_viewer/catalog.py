@@ -0,0 +1,247 @@
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from threading import Event
+
+import requests
+
+from .api import iter_model_pages
+from .metrics import METRICS
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS models (
+    model_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    type TEXT,
+    nsfw INTEGER,
+    creator TEXT,
+    downloads INTEGER,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS sync (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+COLUMNS = ['model_id', 'name', 'type', 'nsfw', 'creator', 'downloads', 'updated_at']
+
+# trigrams shared by more names than that do not discriminate and are skipped by fuzzy matching
+MAX_POSTINGS = 20000
+
+# a sync rebuilds the name index once the names not indexed yet reach a share of the indexed ones,
+# so the rebuilds of a full sync add up to a few builds of the final index
+REINDEX_GROWTH = 0.5
+REINDEX_MIN = 10000
+
+def normalize_name(name: str) -> str:
+    '''lower case words of a name, punctuation dropped'''
+    return ' '.join(re.sub(r'[\W_]+', ' ', name.lower()).split())
+
+def trigrams(text: str) -> set[str]:
+    '''character trigrams of a normalized text, words padded with spaces'''
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def catalog_record(model: dict) -> dict:
+    '''catalog row of a /models item, updated at its most recent version'''
+    dates = [
+        date
+        for version in model.get('modelVersions', [])
+        for date in (version.get('updatedAt'), version.get('publishedAt'), version.get('createdAt'))
+        if date
+    ]
+    return {
+        'model_id': model['id'],
+        'name': model['name'],
+        'type': model.get('type'),
+        'nsfw': model.get('nsfw'),
+        'creator': (model.get('creator') or {}).get('username'),
+        'downloads': (model.get('stats') or {}).get('downloadCount') or 0,
+        'updated_at': max(dates, default=None),
+    }
+
+class NameIndex:
+    '''in-memory index of model names: sorted words for prefixes, trigram postings for typos'''
+
+    def __init__(self, ids: list[int], names: list[str], downloads: list[int]) -> None:
+        self.ids = array('q', ids)
+        self.names = [normalize_name(name) for name in names]
+        self.downloads = array('q', downloads)
+        keys = []
+        self.postings: dict[str, array] = {}
+        for i, name in enumerate(self.names):
+            # most downloaded first among the names sharing a word
+            keys.extend((sys.intern(word), -downloads[i], i) for word in set(name.split()))
+            for trigram in trigrams(name):
+                self.postings.setdefault(trigram, array('I')).append(i)
+        keys.sort()
+        self.words = [word for word, _, _ in keys]
+        self.word_rows = array('I', (i for _, _, i in keys))
+
+    def prefix(self, text: str, limit: int) -> list[int]:
+        '''rows having words starting with text, its words but the last one matched whole'''
+        first, *others = text.split()
+        found = []
+        for position in range(bisect_left(self.words, first), len(self.words)):
+            word = self.words[position]
+            if not word.startswith(first) or (others and word != first) or len(found) >= limit:
+                break
+            i = self.word_rows[position]
+            if not others or f" {text}" in f" {self.names[i]}":
+                found.append(i)
+        return found
+
+    def fuzzy(self, text: str, limit: int) -> list[tuple[float, int]]:
+        '''rows with the most similar names (Dice coefficient of trigrams), best first'''
+        grams = trigrams(text)
+        counts = Counter()
+        for trigram in grams:
+            rows = self.postings.get(trigram, ())
+            if len(rows) <= MAX_POSTINGS:
+                counts.update(rows)
+        scored = [
+            (2 * common / (len(grams) + len(trigrams(self.names[i]))), i)
+            for i, common in counts.most_common(limit * 10)
+        ]
+        scored.sort(reverse=True)
+        return scored[:limit]
+
+    def search(self, text: str, limit: int = 10, min_score: float = 0.3) -> list[tuple[int, bool]]:
+        '''ids of models matching text by prefix first, then tolerant to typos, popular ones first
+
+        Each id comes with whether it only matched tolerant to typos.
+        '''
+        text = normalize_name(text)
+        if not text:
+            return []
+        prefixed = set(self.prefix(text, limit * 20))
+        ranked = sorted(prefixed, key=lambda i: (self.names[i] != text, -self.downloads[i]))[:limit]
+        if len(ranked) < limit:
+            fuzzy = [i for score, i in self.fuzzy(text, limit) if score >= min_score and i not in prefixed]
+            ranked.extend(fuzzy[:limit - len(ranked)])
+        return [(self.ids[i], i not in prefixed) for i in ranked]
+
+class ModelCatalog:
+    '''local SQLite catalog of every model name, synced from the /models listing'''
+
+    def __init__(self, path: str) -> None:
+        if directory := os.path.dirname(path):
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._index: NameIndex | None = None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM models').fetchone()[0]
+
+    def state(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM sync WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key: str, value: str | None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO sync VALUES (?, ?)', (key, value))
+
+    def upsert(self, models: list[dict]) -> int:
+        '''store /models items, return how many were new or updated since last seen'''
+        records = [catalog_record(model) for model in models]
+        with self._lock, self._conn:
+            known = dict(self._conn.execute(
+                f"SELECT model_id, updated_at FROM models WHERE model_id IN ({', '.join('?' * len(records))})",
+                [record['model_id'] for record in records]
+            ).fetchall())
+            changed = [
+                record for record in records
+                if record['model_id'] not in known or known[record['model_id']] != record['updated_at']
+            ]
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO models VALUES ({', '.join('?' * len(COLUMNS))})",
+                [tuple(record[column] for column in COLUMNS) for record in records]
+            )
+        return len(changed)
+
+    def reindex(self) -> None:
+        '''rebuild the name index from the catalog, searches keep the previous one meanwhile'''
+        with self._lock:
+            rows = self._conn.execute('SELECT model_id, name, downloads FROM models').fetchall()
+        self._index = NameIndex([row[0] for row in rows], [row[1] for row in rows], [row[2] or 0 for row in rows])
+
+    @property
+    def indexed(self) -> int:
+        '''names in the name index, 0 until it is built'''
+        return len(self._index.ids) if self._index is not None else 0
+
+    def search(self, text: str, limit: int = 10) -> list[dict]:
+        '''catalog rows of the models matching text, best first, flagged fuzzy when only matched tolerant to typos
+
+        Nothing matches until the name index is built, by the sync thread or reindex.
+        '''
+        if self._index is None:
+            return []
+        with METRICS.timed('civitai_section_seconds', section='catalog_search'):
+            found = dict(self._index.search(text, limit))
+            if not found:
+                return []
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT {', '.join(COLUMNS)} FROM models WHERE model_id IN ({', '.join('?' * len(found))})", list(found)
+                ).fetchall()
+        rows = {row[0]: dict(zip(COLUMNS, row)) for row in rows}
+        return [{**rows[model_id], 'fuzzy': fuzzy} for model_id, fuzzy in found.items() if model_id in rows]
+
+def sync(catalog: ModelCatalog, stop: Event | None = None) -> int:
+    '''page through the models listing into the catalog, return the models new or updated
+
+    A full sync resumes from its last cursor. Once complete, later syncs only read the newest
+    pages until one has nothing new or updated. The name index is rebuilt as the catalog grows
+    and at the end when anything changed.
+    '''
+    stop = stop or Event()
+    complete = catalog.state('complete') == '1'
+    cursor = None if complete else catalog.state('cursor')
+    changed = 0
+    unindexed = 0
+    for page in iter_model_pages(cursor=cursor):
+        page_changed = catalog.upsert(page['items']) if page['items'] else 0
+        changed += page_changed
+        unindexed += page_changed
+        METRICS.count('civitai_catalog_models_total', page_changed)
+        if not complete:
+            catalog.set_state('cursor', page['metadata'].get('nextCursor'))
+        if unindexed >= max(REINDEX_MIN, catalog.indexed * REINDEX_GROWTH):
+            catalog.reindex()
+            unindexed = 0
+        if stop.is_set() or (complete and not page_changed):
+            break
+    else:
+        catalog.set_state('complete', '1')
+        catalog.set_state('cursor', None)
+    catalog.set_state('synced_at', str(time.time()))
+    if unindexed or catalog.indexed == 0:
+        catalog.reindex()
+    return changed
+
+def sync_forever(catalog: ModelCatalog, interval: float, stop: Event | None = None) -> None:
+    '''build the name index, then sync the catalog every interval seconds, errors are retried at the next round
+
+    Without an interval, only the index is built.
+    '''
+    stop = stop or Event()
+    catalog.reindex()
+    while interval and not stop.is_set():
+        try:
+            sync(catalog, stop)
+        except requests.exceptions.RequestException:
+            METRICS.count('civitai_catalog_sync_errors_total')
+        stop.wait(interval)
@@ -0,0 +1,51 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CIVITAI_TOKEN = os.getenv('CIVITAI_TOKEN')
+API_URL = os.getenv('CIVITAI_API_URL', 'https://civitai.com/api/v1/')
+
+MAX_WORKERS = int(os.getenv('CIVITAI_MAX_WORKERS', 8))
+
+RATE_LIMIT = float(os.getenv('CIVITAI_RATE_LIMIT', 5))
+RATE_BURST = int(os.getenv('CIVITAI_RATE_BURST', 10))
+CONNECT_TIMEOUT = float(os.getenv('CIVITAI_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.getenv('CIVITAI_READ_TIMEOUT', 30))
+MAX_RETRIES = int(os.getenv('CIVITAI_MAX_RETRIES', 4))
+
+CACHE_PATH = os.getenv('CIVITAI_CACHE_PATH', '.cache/civitai.sqlite')
+CACHE_MAX_BYTES = int(os.getenv('CIVITAI_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+CACHE_TTL = {
+    'models': int(os.getenv('CIVITAI_CACHE_TTL_MODELS', 3600)),
+    'images': int(os.getenv('CIVITAI_CACHE_TTL_IMAGES', 900)),
+}
+
+IMAGES_PAGE_SIZE = 200
+IMAGES_MAX = int(os.getenv('CIVITAI_IMAGES_MAX', 1000))
+IMAGES_MAX_BYTES = int(os.getenv('CIVITAI_IMAGES_MAX_BYTES', 64 * 1024 * 1024))
+IMAGES_MAX_SECONDS = float(os.getenv('CIVITAI_IMAGES_MAX_SECONDS', 60))
+
+SEARCH_PATH = os.getenv('CIVITAI_SEARCH_PATH', '.cache/prompts.sqlite')
+
+STORE_MAX_BYTES = int(os.getenv('CIVITAI_STORE_MAX_BYTES', 128 * 1024 * 1024))
+BLOBS_MAX_BYTES = int(os.getenv('CIVITAI_BLOBS_MAX_BYTES', 1024 * 1024 * 1024))
+
+METRICS_PORT = int(os.getenv('CIVITAI_METRICS_PORT', 0))
+
+THUMBNAILS_PORT = int(os.getenv('CIVITAI_THUMBNAILS_PORT', 0))
+THUMBNAILS_URL = os.getenv('CIVITAI_THUMBNAILS_URL', f"http://localhost:{THUMBNAILS_PORT}/")
+THUMBNAILS_PATH = os.getenv('CIVITAI_THUMBNAILS_PATH', '.cache/thumbnails.sqlite')
+THUMBNAILS_MAX_BYTES = int(os.getenv('CIVITAI_THUMBNAILS_MAX_BYTES', 512 * 1024 * 1024))
+THUMBNAILS_FORMAT = os.getenv('CIVITAI_THUMBNAILS_FORMAT', 'WEBP').upper()
+THUMBNAILS_HOSTS = tuple(os.getenv('CIVITAI_THUMBNAILS_HOSTS', 'civitai.com').split(','))
+
+CATALOG_PATH = os.getenv('CIVITAI_CATALOG_PATH', '.cache/catalog.sqlite')
+CATALOG_SYNC_INTERVAL = float(os.getenv('CIVITAI_CATALOG_SYNC_INTERVAL', 6 * 3600))
+
+WATCHLIST = tuple(int(model_id) for model_id in os.getenv('CIVITAI_WATCHLIST', '').split(',') if model_id.strip())
+REFRESH_INTERVAL = float(os.getenv('CIVITAI_REFRESH_INTERVAL', 3600))
+REFRESH_RATE = float(os.getenv('CIVITAI_REFRESH_RATE', 1))
+
+ANALYTICS_PATH = os.getenv('CIVITAI_ANALYTICS_PATH', '.cache/analytics')
@@ -0,0 +1,228 @@
+import json
+import os
+import re
+import sys
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full, Queue
+from threading import Event
+
+from .api import get_model, get_models, iter_image_pages, listing_page
+from .config import MAX_WORKERS
+
+RECORD_FIELDS = {
+    'model_id': 'int', 'model_name': 'str', 'model_type': 'str', 'model_nsfw': 'bool', 'creator': 'str',
+    'version_id': 'int', 'version_name': 'str', 'base_model': 'str',
+    'image_id': 'int', 'url': 'str', 'width': 'int', 'height': 'int', 'username': 'str', 'nsfw': 'str',
+    'created_at': 'str', 'prompt': 'str', 'negative_prompt': 'str', 'sampler': 'str', 'steps': 'int',
+    'cfg_scale': 'float', 'seed': 'str', 'clip_skip': 'int', 'model': 'str', 'model_hash': 'str',
+    'has_workflow': 'bool',
+}
+
+PARTITIONS = ('model_id', 'version_id')
+
+def _number(value, kind: type) -> int | float | None:
+    try:
+        return kind(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def flatten(model: dict, version: dict, img: dict) -> dict:
+    '''one flat record of an image with its version and model'''
+    meta = img.get('meta') or {}
+    return {
+        'model_id': model['id'],
+        'model_name': model.get('name'),
+        'model_type': model.get('type'),
+        'model_nsfw': model.get('nsfw'),
+        'creator': (model.get('creator') or {}).get('username'),
+        'version_id': version['id'],
+        'version_name': version.get('name'),
+        'base_model': version.get('baseModel'),
+        'image_id': img['id'],
+        'url': img.get('url'),
+        'width': img.get('width'),
+        'height': img.get('height'),
+        'username': img.get('username'),
+        'nsfw': str(img['nsfw']) if img.get('nsfw') is not None else None,
+        'created_at': img.get('createdAt'),
+        'prompt': meta.get('prompt'),
+        'negative_prompt': meta.get('negativePrompt'),
+        'sampler': meta.get('sampler'),
+        'steps': _number(meta.get('steps'), int),
+        'cfg_scale': _number(meta.get('cfgScale'), float),
+        # as text: seeds go up to 2**64 - 1, past int64 columns
+        'seed': str(seed) if (seed := _number(meta.get('seed'), int)) is not None else None,
+        'clip_skip': _number(meta.get('Clip skip'), int),
+        'model': meta.get('Model'),
+        'model_hash': meta.get('Model hash'),
+        'has_workflow': bool(meta.get('comfy')),
+    }
+
+class Checkpoint:
+    '''append-only log of the cursor reached by each version, to resume an export'''
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.cursors: dict[int, str | None] = {}
+        self.done: set[int] = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.cursors[entry['version_id']] = entry['cursor']
+                    if entry['done']:
+                        self.done.add(entry['version_id'])
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, version_id: int, cursor: str | None, done: bool) -> None:
+        '''persist progress of a version once its page is written'''
+        self._file.write(json.dumps({'version_id': version_id, 'cursor': cursor, 'done': done}) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if done:
+            self.done.add(version_id)
+
+    def close(self) -> None:
+        self._file.close()
+
+class JsonlWriter:
+    '''append records to a JSON lines file'''
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, records: list, version_id: int, part: str) -> None:
+        for record in records:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+class ParquetWriter:
+    '''write each page as a parquet file in hive partitions by model and version'''
+
+    def __init__(self, path: str) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            sys.exit('Parquet export needs pyarrow: pip install pyarrow')
+        self._pa = pa
+        self._pq = pq
+        types = {'int': pa.int64(), 'str': pa.string(), 'bool': pa.bool_(), 'float': pa.float64()}
+        self.schema = pa.schema([
+            (name, types[kind]) for name, kind in RECORD_FIELDS.items() if name not in PARTITIONS
+        ])
+        self.path = path
+
+    def write(self, records: list, version_id: int, part: str) -> None:
+        if not records:
+            return
+        directory = os.path.join(self.path, f"model_id={records[0]['model_id']}", f"version_id={version_id}")
+        os.makedirs(directory, exist_ok=True)
+        table = self._pa.Table.from_pylist(
+            [{name: value for name, value in record.items() if name not in PARTITIONS} for record in records],
+            schema=self.schema
+        )
+        part = re.sub(r'[^\w-]', '_', part)
+        self._pq.write_table(table, os.path.join(directory, f"part-{part}.parquet"))
+
+    def close(self) -> None:
+        pass
+
+def resolve_models(names: list) -> Iterator[dict]:
+    '''models of every name, numeric names being model ids'''
+    for name in names:
+        if name.isdigit():
+            yield get_model(int(name))
+        else:
+            yield from listing_page(get_models(name))['items']
+
+def _put(pages: Queue, item: tuple, stop: Event) -> bool:
+    '''put item in the bounded queue unless the export was stopped'''
+    while not stop.is_set():
+        try:
+            pages.put(item, timeout=0.5)
+            return True
+        except Full:
+            pass
+    return False
+
+def export_version(pages: Queue, stop: Event, model: dict, version: dict, cursor: str | None, max_images: int) -> None:
+    '''push flattened pages of a version to the queue with the cursor they start from
+
+    Runs in the export worker threads: every error is queued to the writer, which
+    otherwise would wait for the version forever.
+    '''
+    try:
+        for page in iter_image_pages(
+                version_id=version['id'],
+                model_id=model['id'],
+                max_images=max_images,
+                max_bytes=sys.maxsize,
+                max_seconds=float('inf'),
+                cursor=cursor,
+                store=False
+            ):
+            records = [flatten(model, version, img) for img in page['items']]
+            next_cursor = page['metadata'].get('nextCursor')
+            done = not next_cursor or page['metadata'].get('truncated', False)
+            if not _put(pages, (version['id'], records, cursor, next_cursor, done), stop):
+                return
+            cursor = next_cursor
+    except Exception as e:
+        _put(pages, (version['id'], e, cursor, cursor, True), stop)
+
+def export(
+        names: list,
+        output: str,
+        output_format: str = 'jsonl',
+        workers: int = MAX_WORKERS,
+        checkpoint_path: str | None = None,
+        max_images: int = sys.maxsize
+    ) -> int:
+    '''stream records of every image of the models to output, resuming from the checkpoint
+
+    Pages are written as they arrive and the queue between fetchers and writer is
+    bounded, so memory does not depend on the size of the export. Progress is
+    checkpointed after each page: an interrupted JSON lines export may repeat the
+    records of the page it was writing, parquet parts are overwritten.
+    '''
+    models = list(resolve_models(names))
+    checkpoint = Checkpoint(checkpoint_path or f"{output.rstrip(os.sep)}.checkpoint")
+    writer = ParquetWriter(output) if output_format == 'parquet' else JsonlWriter(output)
+    pages = Queue(maxsize=workers * 2)
+    stop = Event()
+    pending = 0
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export') as executor:
+        try:
+            for model in models:
+                for version in model.get('modelVersions', []):
+                    if version['id'] in checkpoint.done:
+                        continue
+                    cursor = checkpoint.cursors.get(version['id'])
+                    executor.submit(export_version, pages, stop, model, version, cursor, max_images)
+                    pending += 1
+            while pending:
+                version_id, records, cursor, next_cursor, done = pages.get()
+                if isinstance(records, Exception):
+                    print(f"version {version_id}: {records}", file=sys.stderr)
+                    pending -= 1
+                    continue
+                writer.write(records, version_id=version_id, part=cursor or 'start')
+                written += len(records)
+                checkpoint.record(version_id, next_cursor, done=done)
+                if done:
+                    pending -= 1
+        finally:
+            stop.set()
+    writer.close()
+    checkpoint.close()
+    return written
@@ -0,0 +1,68 @@
+import io
+
+import ijson
+import orjson
+
+from .blobs import BlobStore
+from .store import IMAGE_META
+
+IMAGE_FIELDS = ('id', 'url', 'width', 'height', 'username', 'nsfw', 'createdAt')
+
+def lean_image(img: dict, raw: tuple[int, int]) -> dict:
+    '''fields of an image used by the UI, the index and the export, with the reference of the raw item'''
+    meta = img.get('meta') or {}
+    record = {key: img.get(key) for key in IMAGE_FIELDS}
+    record['meta'] = {key: meta[key] for key in (*IMAGE_META, 'comfy') if key in meta} or None
+    record['raw'] = raw
+    return record
+
+def _workflow(img: dict) -> str | None:
+    '''comfy workflow of an image when embedded as a JSON string, by far the bulk of a page'''
+    comfy = (img.get('meta') or {}).get('comfy')
+    return comfy if isinstance(comfy, str) and comfy else None
+
+def _build(events, prefix: str, event: str, value):
+    '''object or array starting at prefix, built from the parsing events until its end'''
+    builder = ijson.ObjectBuilder()
+    builder.event(event, value)
+    for current, event, value in events:
+        builder.event(event, value)
+        if current == prefix and event in ('end_map', 'end_array'):
+            return builder.value
+
+def ingest_image(img: dict, blobs: BlobStore) -> dict:
+    '''lean record of an image, its workflow then its raw item spilled to the blob store
+
+    Workflows and raw items of images already ingested are not written again.
+    '''
+    if not isinstance(img, dict):
+        raise TypeError(f"image item is not an object: {str(img)[:200]}")
+    if (workflow := _workflow(img)) is not None:
+        ref = blobs.ref(('comfy', img['id'])) or blobs.put_many([workflow.encode()], keys=[('comfy', img['id'])])[0]
+        img['meta']['comfy'] = list(ref)
+    raw = blobs.ref(('raw', img['id'])) or blobs.put_many([orjson.dumps(img)], keys=[('raw', img['id'])])[0]
+    return lean_image(img, raw)
+
+def ingest_images_page(body: bytes, blobs: BlobStore) -> dict:
+    '''page of lean image records parsed item by item from the response bytes
+
+    Only one raw item is built at a time: it is reduced to its record, its comfy workflow
+    given as a string and the item itself written to the blob store for the metadata only
+    a popover displays.
+    '''
+    page = {'items': None, 'metadata': {}}
+    events = ijson.parse(io.BytesIO(body), use_float=True)
+    try:
+        for prefix, event, value in events:
+            if prefix == 'items' and event == 'start_array':
+                page['items'] = []
+            elif prefix == 'items.item':
+                item = _build(events, prefix, event, value) if event in ('start_map', 'start_array') else value
+                page['items'].append(ingest_image(item, blobs))
+            elif prefix == 'metadata' and event == 'start_map':
+                page['metadata'] = _build(events, prefix, event, value)
+    except ijson.JSONError as e:
+        raise ValueError(e)
+    if page['items'] is None:
+        raise ValueError("images page without items")
+    return page
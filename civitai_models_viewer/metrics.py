@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Histogram:
+    '''cumulative buckets, count and sum of observations'''
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float | None:
+        '''upper bound of the bucket holding quantile q'''
+        if not self.count:
+            return None
+        for bound, count in zip(self.buckets, self.counts):
+            if count >= q * self.count:
+                return bound
+        return float('inf')
+
+class Metrics:
+    '''process-wide counters and latency histograms, labelled like Prometheus series'''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        '''add value to a counter'''
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        '''record an observation, in seconds, in a histogram'''
+        key = self._key(name, labels)
+        with self._lock:
+            self.histograms.setdefault(key, Histogram()).observe(value)
+
+    @contextmanager
+    def timed(self, name: str, **labels) -> Iterator[None]:
+        '''observe the duration of the block'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def ratio(self, name: str, label: str, value: str) -> float | None:
+        '''share of a counter having label equal to value, e.g. cache hit ratio'''
+        with self._lock:
+            series = {dict(labels).get(label): total for (n, labels), total in self.counters.items() if n == name}
+        total = sum(series.values())
+        return series.get(value, 0) / total if total else None
+
+    def summary(self) -> list[dict]:
+        '''one row per series, for display'''
+        rows = []
+        with self._lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                rows.append({
+                    'metric': name,
+                    'labels': ', '.join(f"{k}={v}" for k, v in labels),
+                    'count': histogram.count,
+                    'mean': histogram.sum / histogram.count if histogram.count else None,
+                    'p50': histogram.quantile(0.5),
+                    'p95': histogram.quantile(0.95),
+                })
+            for (name, labels), total in sorted(self.counters.items()):
+                rows.append({'metric': name, 'labels': ', '.join(f"{k}={v}" for k, v in labels), 'count': total})
+        return rows
+
+    def prometheus(self) -> str:
+        '''text exposition format'''
+        def series(name: str, labels: tuple, extra: dict | None = None) -> str:
+            pairs = list(labels) + list((extra or {}).items())
+            return name + ('{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}' if pairs else '')
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (n, labels), total in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{series(name, labels)} {total}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), histogram in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{series(name + '_bucket', labels, {'le': bound})} {count}")
+                    lines.append(f"{series(name + '_bucket', labels, {'le': '+Inf'})} {histogram.count}")
+                    lines.append(f"{series(name + '_sum', labels)} {histogram.sum}")
+                    lines.append(f"{series(name + '_count', labels)} {histogram.count}")
+        return '\n'.join(lines) + '\n'
+
+    def jsonl(self) -> str:
+        '''one JSON object per series, stamped with the export time'''
+        now = time.time()
+        return ''.join(json.dumps({'time': now, **row}) + '\n' for row in self.summary())
+
+METRICS = Metrics()
+
+def serve(port: int, metrics: Metrics = METRICS) -> ThreadingHTTPServer:
+    '''serve metrics on /metrics (Prometheus) and /metrics.jsonl from a daemon thread'''
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path == '/metrics':
+                body, content_type = metrics.prometheus(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.jsonl':
+                body, content_type = metrics.jsonl(), 'application/jsonl'
+            else:
+                self.send_error(404)
+                return
+            data = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name='metrics').start()
+    return server
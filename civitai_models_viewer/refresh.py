@@ -0,0 +1,86 @@
+import threading
+import time
+from collections.abc import Callable, Iterator
+from threading import Event
+
+from .api import get_model, iter_image_pages
+from .metrics import METRICS
+from .scheduler import TokenBucket
+from .store import ModelStore, compact_image, compact_model
+
+class Refresher:
+    '''background thread keeping snapshots of watched models warm in the model store
+
+    Every interval, each watched model and the images of its versions are fetched again,
+    revalidated upstream even while cached, within their own rate budget, on top of the API one. A snapshot is swapped in the
+    store only once complete: readers keep the last good one meanwhile.
+    '''
+
+    def __init__(
+            self,
+            store: ModelStore,
+            watchlist: tuple[int, ...],
+            interval: float,
+            rate: float,
+            ingest: Callable[[dict, dict, list], None]
+        ) -> None:
+        self.store = store
+        self.watchlist = watchlist
+        self.interval = interval
+        self.ingest = ingest
+        self.bucket = TokenBucket(rate, burst=1)
+        self.refreshed: dict[int, float] = {}
+        self.errors: dict[int, str] = {}
+        self.refreshing: int | None = None
+        self._stop = Event()
+
+    def start(self) -> 'Refresher':
+        threading.Thread(target=self.run, daemon=True, name='refresher').start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> None:
+        '''refresh every watched model, then again every interval, errors are retried at the next round'''
+        while not self._stop.is_set():
+            for model_id in self.watchlist:
+                if self._stop.is_set():
+                    return
+                self.refreshing = model_id
+                try:
+                    with METRICS.timed('civitai_refresh_seconds'):
+                        self.refresh(model_id)
+                except Exception as e:
+                    self.errors[model_id] = str(e)
+                    METRICS.count('civitai_refresh_total', result='error')
+                else:
+                    self.errors.pop(model_id, None)
+                    METRICS.count('civitai_refresh_total', result='ok')
+                finally:
+                    self.refreshing = None
+            self._stop.wait(self.interval)
+
+    def _pages(self, model: dict, version: dict) -> Iterator[dict]:
+        '''image pages of a version, each fetch waiting for the refresh budget'''
+        pages = iter_image_pages(version_id=version['id'], model_id=model['id'], blobs=self.store.blobs, revalidate=True)
+        while True:
+            self.bucket.acquire()
+            if (page := next(pages, None)) is None:
+                return
+            yield page
+
+    def refresh(self, model_id: int) -> None:
+        '''fetch a model and its images, then swap them in the store version by version'''
+        self.bucket.acquire()
+        model = get_model(model_id, revalidate=True)
+        for version in model.get('modelVersions', []):
+            images = {'items': [], 'metadata': {}}
+            for page in self._pages(model, version):
+                self.ingest(model, version, page['items'])
+                images['items'].extend(compact_image(img) for img in page['items'])
+                images['metadata'] = page['metadata']
+            images['fetched_at'] = time.time()
+            self.store.put(('images', version['id']), images)
+        self.store.put(('model', model_id), {'items': [compact_model(model, self.store.blobs)], 'fetched_at': time.time()})
+        self.refreshed[model_id] = time.time()
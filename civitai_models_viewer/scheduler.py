@@ -0,0 +1,121 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+from email.utils import parsedate_to_datetime
+
+import requests
+
+RETRY_STATUSES = {429, 502, 503, 504}
+
+class TokenBucket:
+    '''allow `rate` requests per second on average, bursts of up to `burst`'''
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        '''block until a token is available and take it'''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+def retry_after(response: requests.Response) -> float | None:
+    '''seconds to wait asked by the Retry-After header, in seconds or as an HTTP date'''
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RequestScheduler:
+    '''single gate of API traffic: rate limited, retried with backoff and coalesced
+
+    Identical requests in flight, from any thread or session, share the answer
+    of a single upstream call.
+    '''
+
+    def __init__(
+            self,
+            session: requests.Session,
+            rate: float,
+            burst: int,
+            timeout: tuple[float, float],
+            max_retries: int,
+            backoff_base: float = 0.5,
+            backoff_max: float = 30.0
+        ) -> None:
+        self.session = session
+        self.bucket = TokenBucket(rate, burst)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._inflight: dict[tuple, Future] = {}
+
+    def get(self, url: str, headers: dict | None = None) -> requests.Response:
+        '''GET url, waiting for the identical request already in flight if any'''
+        key = (url, tuple(sorted((headers or {}).items())))
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            response = self._send(url, headers)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(response)
+            return response
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def backoff(self, attempt: int) -> float:
+        '''full jitter exponential backoff delay of attempt'''
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _send(self, url: str, headers: dict | None) -> requests.Response:
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                delay = retry_after(response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                elif delay > self.backoff_max:
+                    return response
+                else:
+                    delay += random.uniform(0, self.backoff_base)
+            time.sleep(delay)
+            attempt += 1
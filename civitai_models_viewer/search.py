@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import threading
+
+from .export import flatten
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    image_id INTEGER PRIMARY KEY,
+    model_id INTEGER,
+    model_name TEXT,
+    version_id INTEGER,
+    version_name TEXT,
+    url TEXT,
+    sampler TEXT,
+    steps REAL,
+    cfg_scale REAL,
+    seed TEXT,
+    model TEXT
+);
+CREATE INDEX IF NOT EXISTS images_version ON images (version_id);
+CREATE INDEX IF NOT EXISTS images_sampler ON images (sampler);
+CREATE VIRTUAL TABLE IF NOT EXISTS prompts USING fts5(prompt, negative_prompt);
+'''
+
+COLUMNS = ['image_id', 'model_id', 'model_name', 'version_id', 'version_name', 'url', 'sampler', 'steps', 'cfg_scale', 'seed', 'model']
+
+def fts_query(text: str, negative: bool = False) -> str:
+    '''FTS5 query matching every word of text, the last one as a prefix
+
+    Words are quoted so user input can not break the query syntax.
+    '''
+    words = ['"' + word.replace('"', '""') + '"' for word in text.split()]
+    if not words:
+        return ''
+    words[-1] += '*'
+    return ' '.join(words) if negative else f"prompt : ({' '.join(words)})"
+
+class PromptIndex:
+    '''SQLite full text index of image prompts and generation parameters, shared by sessions'''
+
+    def __init__(self, path: str) -> None:
+        if directory := os.path.dirname(path):
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def add(self, model: dict, version: dict, items: list) -> None:
+        '''index a page of images of a version'''
+        records = [flatten(model, version, img) for img in items]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO images VALUES ({', '.join('?' * len(COLUMNS))})",
+                [tuple(record[column] for column in COLUMNS) for record in records]
+            )
+            self._conn.executemany('DELETE FROM prompts WHERE rowid = ?', [(record['image_id'],) for record in records])
+            self._conn.executemany(
+                'INSERT INTO prompts (rowid, prompt, negative_prompt) VALUES (?, ?, ?)',
+                [(record['image_id'], record['prompt'] or '', record['negative_prompt'] or '') for record in records]
+            )
+
+    def _where(
+            self,
+            text: str,
+            negative: bool,
+            samplers: list | None,
+            steps: tuple | None,
+            cfg: tuple | None,
+            version_ids: list | None
+        ) -> tuple[str, str, list]:
+        '''FROM and WHERE clauses of a search, with their parameters'''
+        clauses = []
+        params = []
+        if query := fts_query(text, negative=negative):
+            source = 'prompts JOIN images ON images.image_id = prompts.rowid'
+            clauses.append('prompts MATCH ?')
+            params.append(query)
+        else:
+            source = 'images'
+        if samplers:
+            clauses.append(f"images.sampler IN ({', '.join('?' * len(samplers))})")
+            params.extend(samplers)
+        if version_ids:
+            clauses.append(f"images.version_id IN ({', '.join('?' * len(version_ids))})")
+            params.extend(version_ids)
+        for column, bounds in (('steps', steps), ('cfg_scale', cfg)):
+            if bounds:
+                clauses.append(f"images.{column} BETWEEN ? AND ?")
+                params.extend(bounds)
+        return source, ' AND '.join(clauses) or '1', params
+
+    def search(
+            self,
+            text: str,
+            negative: bool = False,
+            samplers: list | None = None,
+            steps: tuple | None = None,
+            cfg: tuple | None = None,
+            version_ids: list | None = None,
+            limit: int = 200
+        ) -> list[dict]:
+        '''images whose prompt matches text and parameters the filters, best matches first
+
+        Steps and CFG bounds exclude the images without a value: pass None not to filter.
+        '''
+        source, where, params = self._where(text, negative, samplers, steps, cfg, version_ids)
+        match = source != 'images'
+        snippet = "snippet(prompts, 0, '**', '**', '…', 24)" if match else "''"
+        order = 'bm25(prompts)' if match else 'images.image_id DESC'
+        columns = ', '.join(f"images.{column}" for column in COLUMNS)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {columns}, {snippet} FROM {source} WHERE {where} ORDER BY {order} LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        return [dict(zip(COLUMNS + ['snippet'], row)) for row in rows]
+
+    def versions(
+            self,
+            text: str,
+            negative: bool = False,
+            samplers: list | None = None,
+            steps: tuple | None = None,
+            cfg: tuple | None = None,
+            version_ids: list | None = None
+        ) -> list[dict]:
+        '''number of matching images per model version, most used first'''
+        source, where, params = self._where(text, negative, samplers, steps, cfg, version_ids)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT images.model_name, images.version_name, images.version_id, COUNT(*) AS images "
+                f"FROM {source} WHERE {where} GROUP BY images.version_id ORDER BY images DESC",
+                params
+            ).fetchall()
+        return [dict(zip(['model_name', 'version_name', 'version_id', 'images'], row)) for row in rows]
+
+    def facets(self) -> dict:
+        '''samplers and steps / CFG bounds of indexed images, for the filters'''
+        with self._lock:
+            samplers = [row[0] for row in self._conn.execute(
+                'SELECT sampler FROM images WHERE sampler IS NOT NULL GROUP BY sampler ORDER BY COUNT(*) DESC'
+            )]
+            bounds = self._conn.execute(
+                'SELECT MIN(steps), MAX(steps), MIN(cfg_scale), MAX(cfg_scale) FROM images'
+            ).fetchone()
+        return {'samplers': samplers, 'steps': bounds[:2], 'cfg': bounds[2:]}
@@ -0,0 +1,67 @@
+import hashlib
+from dataclasses import dataclass
+
+import pandas as pd
+
+COLUMNS = ['id', 'sampler', 'steps', 'cfgScale', 'seed', 'size', 'clipSkip', 'modelHash']
+NUMERIC_COLUMNS = ['steps', 'cfgScale', 'seed', 'clipSkip']
+DISTRIBUTION = {'min': 'min', '25%': 'p25', 'mean': 'mean', '75%': 'p75', 'max': 'max'}
+
+@dataclass
+class VersionStats:
+    '''aggregated generation stats of a version, shaped for the charts'''
+    samplers: pd.DataFrame
+    steps: pd.DataFrame
+    cfg: pd.DataFrame
+    steps_histogram: pd.DataFrame
+    cfg_histogram: pd.DataFrame
+
+def images_digest(items: list) -> str:
+    '''content hash of images, from their ids'''
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(','.join(str(img['id']) for img in items).encode())
+    return digest.hexdigest()
+
+def images_frame(items: list) -> pd.DataFrame:
+    '''generation parameters of images as columns, in a single pass over the images'''
+    rows = []
+    for img in items:
+        if meta := img.get('meta'):
+            rows.append((
+                img['id'],
+                meta.get('sampler') or None,
+                meta.get('steps'),
+                meta.get('cfgScale'),
+                meta.get('seed'),
+                f"{img.get('width')}x{img.get('height')}",
+                meta.get('Clip skip'),
+                meta.get('Model hash'),
+            ))
+    frame = pd.DataFrame.from_records(rows, columns=COLUMNS)
+    for column in NUMERIC_COLUMNS:
+        frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    return frame
+
+def _distribution(described: pd.DataFrame, column: str, name: str) -> pd.DataFrame:
+    '''min, quartiles, mean and max of a column per sampler, in long format'''
+    distribution = described[column][list(DISTRIBUTION)].rename(columns=DISTRIBUTION)
+    distribution = distribution.dropna(how='all').rename_axis('samplers').reset_index()
+    return distribution.melt(id_vars='samplers', var_name='group', value_name=name)
+
+def _histogram(frame: pd.DataFrame, column: str) -> pd.DataFrame:
+    '''number of images per sampler and value of a column'''
+    return frame.groupby(['sampler', column]).size().reset_index(name='count')
+
+def version_stats(frame: pd.DataFrame) -> VersionStats:
+    '''aggregate sampler counts and steps/CFG distributions with one groupby'''
+    frame = frame.dropna(subset=['sampler'])
+    grouped = frame.groupby('sampler')
+    described = grouped[['steps', 'cfgScale']].describe()
+    samplers = grouped.size().reset_index(name='count')
+    return VersionStats(
+        samplers=samplers,
+        steps=_distribution(described, 'steps', 'steps'),
+        cfg=_distribution(described, 'cfgScale', 'CFG'),
+        steps_histogram=_histogram(frame, 'steps'),
+        cfg_histogram=_histogram(frame, 'cfgScale'),
+    )
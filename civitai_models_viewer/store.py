@@ -0,0 +1,195 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable, Iterator
+
+from .blobs import BlobStore
+
+MODEL_STATS = ('downloadCount', 'thumbsUpCount', 'thumbsDownCount', 'commentCount')
+IMAGE_META = ('Model', 'prompt', 'negativePrompt', 'seed', 'steps', 'cfgScale', 'sampler', 'Clip skip', 'Model hash')
+PROMPTS = ('prompt', 'negativePrompt')
+
+def normalize_query(model_name: str) -> str:
+    '''store key of a models query: case and spacing do not matter'''
+    return ' '.join(model_name.split()).lower()
+
+def compact_model(model: dict, blobs: BlobStore) -> dict:
+    '''fields of a model used by the UI, its description spilled to the blob store once per content'''
+    description = (model.get('description') or '').encode()
+    spilled = ('description', model['id'], hashlib.sha256(description).hexdigest()[:16])
+    compact = {
+        'id': model['id'],
+        'name': model['name'],
+        'type': model.get('type'),
+        'nsfw': model.get('nsfw'),
+        'tags': model.get('tags', []),
+        'stats': {key: model.get('stats', {}).get(key) for key in MODEL_STATS},
+        'description': blobs.ref(spilled) or blobs.put_many([description], keys=[spilled])[0],
+        'modelVersions': [
+            {
+                'id': version['id'],
+                'name': version.get('name'),
+                'baseModel': version.get('baseModel'),
+                'downloadUrl': version.get('downloadUrl'),
+            }
+            for version in model.get('modelVersions', [])
+        ],
+    }
+    if creator := model.get('creator'):
+        compact['creator'] = {'username': creator.get('username'), 'image': creator.get('image')}
+    return compact
+
+def compact_image(img: dict) -> dict:
+    '''fields of an image used by the UI, prompts left in the blob store when the raw item is there'''
+    meta = img.get('meta') or {}
+    keys = [key for key in IMAGE_META if key not in PROMPTS] if 'raw' in img else IMAGE_META
+    compact = {
+        'id': img['id'],
+        'url': img.get('url'),
+        'width': img.get('width'),
+        'height': img.get('height'),
+        'username': img.get('username'),
+        'meta': {key: meta[key] for key in keys if key in meta} or None,
+    }
+    if 'raw' in img:
+        compact['raw'] = img['raw']
+    return compact
+
+def blob_refs(value) -> Iterator[tuple[int, int]]:
+    '''blob references of the descriptions and raw items of a store entry'''
+    for item in value.get('items', ()) if isinstance(value, dict) else ():
+        for key in ('description', 'raw'):
+            if ref := item.get(key):
+                yield ref
+
+def footprint(value) -> int:
+    '''approximate bytes of a compact record'''
+    return len(json.dumps(value, default=str))
+
+class PendingImages:
+    '''images of a version being fetched by a worker, readable page by page while it runs'''
+
+    def __init__(self) -> None:
+        self.items: list[dict] = []
+        self.metadata: dict = {}
+        self.errors: list[Exception] = []
+        self.done = False
+        self._changed = threading.Condition()
+
+    def add(self, items: list[dict], metadata: dict) -> None:
+        with self._changed:
+            self.items.extend(items)
+            self.metadata = metadata
+            self._changed.notify_all()
+
+    def fail(self, error: Exception) -> None:
+        with self._changed:
+            self.errors.append(error)
+            self._changed.notify_all()
+
+    def finish(self) -> None:
+        with self._changed:
+            self.done = True
+            self._changed.notify_all()
+
+    def follow(self) -> Iterator[tuple[dict, list]]:
+        '''images received so far and the new ones, then again after every page until done'''
+        seen = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: len(self.items) > seen or self.done)
+                images = {'items': self.items[:], 'metadata': self.metadata}
+                done = self.done
+            yield images, images['items'][seen:]
+            seen = len(images['items'])
+            if done:
+                return
+
+class ModelStore:
+    '''compact models and images shared by every session, LRU evicted under a byte budget
+
+    Entries are keyed by ('query', normalized name), ('model', id) and ('images', version id).
+    Sessions reading or writing an entry are recorded to account their footprint. An entry
+    referring to blobs the blob store dropped is evicted when read, to be fetched again.
+    '''
+
+    def __init__(self, max_bytes: int, blobs: BlobStore) -> None:
+        self.max_bytes = max_bytes
+        self.blobs = blobs
+        self._lock = threading.Lock()
+        # value, footprint and offset of the oldest blob referred to of each entry, least recently used first
+        self._entries: OrderedDict[Hashable, tuple[object, int, int | None]] = OrderedDict()
+        self._sessions: dict[str, set] = {}
+        self.nbytes = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, session_id: str | None = None):
+        '''value of key, None if never stored or evicted'''
+        with self._lock:
+            if key not in self._entries:
+                return None
+            if (oldest := self._entries[key][2]) is not None and oldest < self.blobs.floor:
+                self.nbytes -= self._entries.pop(key)[1]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            self._account(key, session_id)
+            return self._entries[key][0]
+
+    def put(self, key: Hashable, value, session_id: str | None = None) -> None:
+        '''store value of key then evict least recently used entries over budget'''
+        size = footprint(value)
+        oldest = min((ref[0] for ref in blob_refs(value)), default=None)
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size, oldest)
+            self.nbytes += size
+            self._account(key, session_id)
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def description(self, model: dict) -> str:
+        '''description HTML of a compact model, read back from the blob store, empty once dropped'''
+        try:
+            return self.blobs.get(model['description']).decode()
+        except KeyError:
+            return ''
+
+    def raw_image(self, image: dict) -> dict:
+        '''image as received from the API when its raw item was spilled and not dropped, else the compact image'''
+        if 'raw' not in image:
+            return image
+        try:
+            return json.loads(self.blobs.get(image['raw']))
+        except KeyError:
+            return image
+
+    def image_meta(self, image: dict) -> dict | None:
+        '''full metadata of a compact image'''
+        return self.raw_image(image).get('meta')
+
+    def footprint(self, session_id: str) -> int:
+        '''bytes of the entries still stored that session used'''
+        with self._lock:
+            return sum(self._entries[key][1] for key in self._sessions.get(session_id, ()) if key in self._entries)
+
+    def stats(self) -> dict:
+        '''global memory accounting'''
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+                'sessions': len(self._sessions),
+                'blob_bytes': self.blobs.nbytes,
+                'blob_reclaimed': self.blobs.reclaimed,
+            }
+
+    def _account(self, key: Hashable, session_id: str | None) -> None:
+        if session_id is not None:
+            self._sessions.setdefault(session_id, set()).add(key)
@@ -0,0 +1,132 @@
+import io
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+import requests
+from PIL import Image
+
+from .cache import ResponseCache
+from .metrics import METRICS
+
+THUMBNAIL_WIDTHS = (64, 256, 512, 1024)
+CONTENT_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+ORIGINAL_TIMEOUT = (5, 30)
+
+def thumbnail_width(width: int) -> int:
+    '''smallest fixed width covering width'''
+    return next((w for w in THUMBNAIL_WIDTHS if w >= width), THUMBNAIL_WIDTHS[-1])
+
+def thumbnail_key(url: str, width: int, image_format: str) -> str:
+    '''cache key of a thumbnail, the original url with its width and format'''
+    return f"{url}{'&' if '?' in url else '?'}thumbnail={width}.{image_format.lower()}"
+
+def resize(original: bytes, widths: tuple, image_format: str) -> dict[int, bytes]:
+    '''encode the original at each width narrower than itself, at its own width when wider than them all'''
+    with Image.open(io.BytesIO(original)) as image:
+        image.draft('RGB', (max(widths), max(widths)))
+        image = image.convert('RGBA' if image_format == 'WEBP' and image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        thumbnails = {}
+        for width in sorted(widths, reverse=True):
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+            elif thumbnails:
+                continue
+            output = io.BytesIO()
+            image.save(output, image_format, quality=80)
+            thumbnails[width] = output.getvalue()
+        return thumbnails
+
+class ThumbnailProxy:
+    '''fetch each original once, downscale it to the fixed widths and keep them in a bounded disk cache'''
+
+    def __init__(self, cache: ResponseCache, image_format: str = 'WEBP', hosts: tuple = ('civitai.com',)) -> None:
+        self.cache = cache
+        self.image_format = image_format
+        self.hosts = hosts
+        self.session = requests.Session()
+        self._lock = threading.Lock()
+        self._fetching: dict[str, threading.Lock] = {}
+
+    def allowed(self, url: str) -> bool:
+        '''only proxy images of the configured hosts and their subdomains'''
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        return parts.scheme in ('http', 'https') and any(host == h or host.endswith(f".{h}") for h in self.hosts)
+
+    def _cached(self, url: str, width: int) -> bytes | None:
+        '''cached thumbnail at width or wider, empty when the original is known not to be a picture'''
+        for w in (*THUMBNAIL_WIDTHS[THUMBNAIL_WIDTHS.index(width):], 0):
+            if cached := self.cache.get(thumbnail_key(url, w, self.image_format)):
+                return cached.body
+        return None
+
+    def thumbnail(self, url: str, width: int) -> bytes | None:
+        '''thumbnail of url at a fixed width, None when the original is not a picture'''
+        width = thumbnail_width(width)
+        if (body := self._cached(url, width)) is not None:
+            METRICS.count('civitai_thumbnail_requests_total', result='hit')
+            return body or None
+        with self._lock:
+            fetching = self._fetching.setdefault(url, threading.Lock())
+        try:
+            with fetching:
+                if (body := self._cached(url, width)) is not None:
+                    METRICS.count('civitai_thumbnail_requests_total', result='hit')
+                    return body or None
+                METRICS.count('civitai_thumbnail_requests_total', result='miss')
+                response = self.session.get(url, timeout=ORIGINAL_TIMEOUT)
+                response.raise_for_status()
+                METRICS.count('civitai_thumbnail_bytes_total', len(response.content), source='original')
+                try:
+                    with METRICS.timed('civitai_thumbnail_seconds'):
+                        thumbnails = resize(response.content, THUMBNAIL_WIDTHS, self.image_format)
+                except (OSError, ValueError, Image.DecompressionBombError):
+                    thumbnails = {0: b''}
+                for w, thumbnail in thumbnails.items():
+                    self.cache.put(thumbnail_key(url, w, self.image_format), thumbnail, ttl=sys.maxsize)
+                return self._cached(url, width) or None
+        finally:
+            with self._lock:
+                self._fetching.pop(url, None)
+
+def thumbnail_url(proxy_url: str, url: str, width: int) -> str:
+    '''url of the thumbnail of an image served by the proxy'''
+    return f"{proxy_url}?url={quote(url, safe='')}&w={thumbnail_width(width)}"
+
+def serve(port: int, proxy: ThumbnailProxy) -> ThreadingHTTPServer:
+    '''serve thumbnails on /?url=...&w=... from a daemon thread, redirect to the original when it cannot be resized'''
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            query = parse_qs(urlsplit(self.path).query)
+            url = query.get('url', [''])[0]
+            if not proxy.allowed(url):
+                self.send_error(403)
+                return
+            try:
+                body = proxy.thumbnail(url, int(query.get('w', [THUMBNAIL_WIDTHS[-1]])[0]))
+            except (ValueError, requests.exceptions.RequestException):
+                body = None
+            if body is None:
+                METRICS.count('civitai_thumbnail_requests_total', result='passthrough')
+                self.send_response(302)
+                self.send_header('Location', url)
+                self.end_headers()
+                return
+            METRICS.count('civitai_thumbnail_bytes_total', len(body), source='thumbnail')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPES[proxy.image_format])
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='thumbnails').start()
+    return server
@@ -0,0 +1,49 @@
+import json
+
+from .blobs import BlobStore
+
+class WorkflowIndex:
+    '''ComfyUI blobs of ingested images, kept raw in a blob store and addressed by image id
+
+    Images only keep the presence of their workflow: the blob is moved out of
+    their metadata at ingestion and parsed when a download asks for it. A workflow
+    already spilled at parsing is found under the same ('comfy', image id) key, and
+    one dropped from the blob store is gone.
+    '''
+
+    def __init__(self, blobs: BlobStore | None = None) -> None:
+        self.blobs = blobs or BlobStore()
+
+    def ingest(self, img: dict) -> None:
+        '''move comfy blob out of image metadata and record it under the image id'''
+        meta = img.get('meta')
+        if not meta or not (comfy := meta.pop('comfy', None)):
+            return
+        if isinstance(comfy, (list, tuple)) or img['id'] in self:
+            return
+        blob = comfy.encode() if isinstance(comfy, str) else json.dumps(comfy).encode()
+        self.blobs.put_many([blob], keys=[('comfy', img['id'])])
+
+    def __contains__(self, image_id: int) -> bool:
+        return self.blobs.ref(('comfy', image_id)) is not None
+
+    def blob(self, image_id: int) -> bytes | None:
+        '''raw comfy blob of image, None when it has none or it was dropped'''
+        if (ref := self.blobs.ref(('comfy', image_id))) is None:
+            return None
+        try:
+            return self.blobs.get(ref)
+        except KeyError:
+            return None
+
+def workflow_of(blob: bytes) -> dict | None:
+    '''workflow graph of a comfy blob, None when missing or malformed'''
+    try:
+        workflow = json.loads(blob).get('workflow')
+    except (ValueError, AttributeError):
+        return None
+    return workflow if isinstance(workflow, dict) and workflow else None
+
+def pretty_workflow(blob: bytes) -> str | None:
+    '''workflow of a comfy blob, indented for download, None when it has no graph'''
+    return None if (workflow := workflow_of(blob)) is None else json.dumps(workflow, indent=4)
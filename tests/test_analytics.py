@@ -0,0 +1,28 @@
+import pandas as pd
+
+from civitai_models_viewer.analytics import compare
+
+def frame() -> pd.DataFrame:
+    return pd.DataFrame({
+        'image_id': [1, 2, 3, 4],
+        'model_id': [1, 1, 2, 2],
+        'model_name': ['realism', 'realism', 'realism', 'realism'],
+        'base_model': ['SDXL', 'SDXL', 'SD 1.5', 'SD 1.5'],
+        'width': [832, 832, 512, None],
+        'height': [1216, 1216, 768, None],
+        'sampler': ['Euler a', 'DPM++ 2M', 'Euler a', 'Euler a'],
+        'steps': [20, 30, 25, None],
+        'cfg_scale': [7, 5, 6, 7],
+    })
+
+def test_models_sharing_a_name_are_compared_apart():
+    comparison = compare(frame(), 'model_id')
+    assert comparison.images.to_dict('records') == [
+        {'model_id': 1, 'label': 'realism #1', 'images': 2},
+        {'model_id': 2, 'label': 'realism #2', 'images': 2},
+    ]
+    assert comparison.steps.set_index('model_id')['median'].to_dict() == {1: 25, 2: 25}
+
+def test_resolutions_are_labelled_as_integers():
+    resolutions = compare(frame(), 'model_id').resolutions
+    assert set(resolutions['resolution']) == {'832x1216', '512x768'}
@@ -0,0 +1,42 @@
+import csv
+import io
+import json
+import zipfile
+
+from civitai_models_viewer.bundle import bundle_workflows
+from civitai_models_viewer.workflows import WorkflowIndex, pretty_workflow
+
+MODEL = {'id': 1, 'name': 'model'}
+VERSION = {'id': 10, 'name': 'v1'}
+NODES = [{'id': 3, 'type': 'KSampler'}]
+
+def image(image_id: int, comfy) -> dict:
+    return {'id': image_id, 'meta': {'prompt': 'red', 'comfy': json.dumps(comfy)}}
+
+def test_identical_workflows_are_stored_once_and_malformed_ones_skipped():
+    workflows = WorkflowIndex()
+    images = [
+        image(1, {'workflow': {'nodes': NODES, 'extra': {'ds': {'scale': 1}}}}),
+        image(2, {'workflow': {'nodes': NODES, 'extra': {'ds': {'scale': 2}}}}),
+        image(3, {'workflow': [1, 2]}),
+        image(4, {'workflow': 'nodes'}),
+    ]
+    for img in images:
+        workflows.ingest(img)
+    with bundle_workflows(((MODEL, VERSION, img) for img in images), workflows, lambda img: img) as output:
+        with zipfile.ZipFile(output) as archive:
+            names = [name for name in archive.namelist() if name.startswith('workflows/')]
+            workflow = json.loads(archive.read(names[0]))
+            manifest = json.loads(archive.read('manifest.json'))
+            rows = list(csv.DictReader(io.StringIO(archive.read('metadata.csv').decode())))
+    workflows.blobs.close()
+    assert len(names) == 1
+    assert workflow == {'nodes': NODES, 'extra': {}}
+    assert manifest == {'images': {'1': names[0], '2': names[0]}, 'workflows': {names[0]: 2}}
+    assert [row['has_workflow'] for row in rows] == ['True', 'True', 'False', 'False']
+
+def test_only_workflow_graphs_are_downloadable():
+    assert json.loads(pretty_workflow(json.dumps({'workflow': {'nodes': NODES}}).encode())) == {'nodes': NODES}
+    assert pretty_workflow(b'{"workflow": [1, 2]}') is None
+    assert pretty_workflow(b'{"workflow": null}') is None
+    assert pretty_workflow(b'not json') is None
@@ -0,0 +1,73 @@
+import time
+
+from civitai_models_viewer import api
+from civitai_models_viewer.cache import ResponseCache
+
+URL = 'https://civitai.com/api/v1/models/1'
+
+class Response:
+    def __init__(self, status_code: int, content: bytes = b'', headers: dict | None = None) -> None:
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self) -> None:
+        pass
+
+class Scheduler:
+    def __init__(self, *responses: Response) -> None:
+        self.responses = list(responses)
+        self.headers = []
+
+    def get(self, url: str, headers: dict | None = None) -> Response:
+        self.headers.append(headers)
+        return self.responses.pop(0)
+
+def test_entries_expire_after_their_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_bytes=1024)
+    cache.put(URL, b'body', ttl=60, etag='"v1"')
+    assert cache.get(URL).fresh
+    cache.put(URL, b'body', ttl=0, etag='"v1"')
+    cached = cache.get(URL)
+    assert not cached.fresh
+    assert cached.validators() == {'If-None-Match': '"v1"'}
+
+def test_stale_entries_are_revalidated(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_bytes=1024)
+    scheduler = Scheduler(Response(200, b'{"id": 1}', {'ETag': '"v1"'}), Response(304))
+    monkeypatch.setattr(api, 'get_cache', lambda: cache)
+    monkeypatch.setattr(api, 'get_scheduler', lambda: scheduler)
+    monkeypatch.setitem(api.CACHE_TTL, 'models', 0)
+    assert api.fetch_raw('models/1') == b'{"id": 1}'
+    assert api.fetch_raw('models/1') == b'{"id": 1}'
+    assert scheduler.headers == [None, {'If-None-Match': '"v1"'}]
+
+def test_least_recently_used_entries_are_evicted_over_budget(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_bytes=250)
+    for n in range(3):
+        cache.put(f"{URL}?n={n}", bytes(100), ttl=60)
+        time.sleep(0.01)
+    assert cache.get(f"{URL}?n=0") is None
+    assert cache.size() == 200
+    cache.get(f"{URL}?n=1")
+    cache.put(f"{URL}?n=3", bytes(100), ttl=60)
+    assert cache.get(f"{URL}?n=2") is None
+    assert cache.get(f"{URL}?n=1") is not None
+
+def test_total_follows_replaced_entries_and_reopening(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = ResponseCache(path, max_bytes=1024)
+    cache.put(URL, bytes(100), ttl=60)
+    cache.put(URL, bytes(40), ttl=60)
+    assert cache.size() == 40
+    assert ResponseCache(path, max_bytes=1024).size() == 40
+
+def test_fresh_entries_are_revalidated_on_demand(tmp_path, monkeypatch):
+    cache = ResponseCache(str(tmp_path / 'cache.sqlite'), max_bytes=1024)
+    scheduler = Scheduler(Response(200, b'{"id": 1}', {'ETag': '"v1"'}), Response(304))
+    monkeypatch.setattr(api, 'get_cache', lambda: cache)
+    monkeypatch.setattr(api, 'get_scheduler', lambda: scheduler)
+    assert api.fetch_raw('models/1') == b'{"id": 1}'
+    assert api.fetch_raw('models/1') == b'{"id": 1}'
+    assert api.fetch_raw('models/1', revalidate=True) == b'{"id": 1}'
+    assert scheduler.headers == [None, {'If-None-Match': '"v1"'}]
@@ -0,0 +1,40 @@
+from civitai_models_viewer import catalog as catalog_module
+from civitai_models_viewer.catalog import ModelCatalog
+
+MODELS = [
+    {'id': 1, 'name': 'Realistic Stock Photo', 'stats': {'downloadCount': 300}},
+    {'id': 2, 'name': 'Juggernaut XL', 'stats': {'downloadCount': 200}},
+    {'id': 3, 'name': 'Pony Diffusion V6 XL', 'stats': {'downloadCount': 100}},
+]
+
+def catalog(tmp_path) -> ModelCatalog:
+    models = ModelCatalog(str(tmp_path / 'catalog.sqlite'))
+    models.upsert(MODELS)
+    models.reindex()
+    return models
+
+def test_prefix_matches_are_not_fuzzy(tmp_path):
+    matches = catalog(tmp_path).search('jugg')
+    assert [(match['model_id'], match['fuzzy']) for match in matches] == [(2, False)]
+
+def test_names_missing_from_the_catalog_only_match_fuzzy(tmp_path):
+    models = catalog(tmp_path)
+    for text in ('epic realism', 'pony realism', 'juggernaut reborn'):
+        assert all(match['fuzzy'] for match in models.search(text)), text
+
+def test_nothing_matches_until_the_index_is_built(tmp_path):
+    models = ModelCatalog(str(tmp_path / 'catalog.sqlite'))
+    models.upsert(MODELS)
+    assert models.search('jugg') == []
+
+def test_sync_rebuilds_the_index_as_the_catalog_grows(tmp_path, monkeypatch):
+    pages = [{'items': [{'id': n, 'name': f"model {n}"}], 'metadata': {'nextCursor': str(n)}} for n in range(1, 7)]
+    monkeypatch.setattr(catalog_module, 'iter_model_pages', lambda cursor=None: iter(pages))
+    monkeypatch.setattr(catalog_module, 'REINDEX_MIN', 2)
+    reindex = ModelCatalog.reindex
+    sizes = []
+    monkeypatch.setattr(ModelCatalog, 'reindex', lambda self: (reindex(self), sizes.append(self.indexed)))
+    models = ModelCatalog(str(tmp_path / 'catalog.sqlite'))
+    assert catalog_module.sync(models) == 6
+    assert sizes == [2, 4, 6]
+    assert models.search('model 5')[0]['model_id'] == 5
@@ -0,0 +1,46 @@
+import json
+import threading
+
+import pytest
+import requests
+
+from civitai_models_viewer import api, export
+
+MODEL = {'id': 1, 'name': 'model', 'modelVersions': [{'id': 10, 'name': 'v1'}, {'id': 11, 'name': 'v2'}]}
+
+def pages(version_id: int, **options):
+    assert options['store'] is False
+    if version_id == 10:
+        raise KeyError('items')
+    yield {'items': [{'id': 100, 'meta': {'prompt': 'red'}}], 'metadata': {}}
+
+def test_worker_errors_do_not_block_the_export(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(export, 'resolve_models', lambda names: iter([MODEL]))
+    monkeypatch.setattr(export, 'iter_image_pages', pages)
+    output = tmp_path / 'images.jsonl'
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(written=export.export(['model'], str(output), workers=2)), daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert result['written'] == 1
+    assert [json.loads(line)['image_id'] for line in output.read_text().splitlines()] == [100]
+    assert 'version 10' in capsys.readouterr().err
+
+@pytest.mark.parametrize('body', [b'{"error": "bad request"}', b'[]'])
+def test_listing_page_without_items_is_a_request_error(body):
+    with pytest.raises(requests.exceptions.InvalidJSONError):
+        api.listing_page(api.parse_json(body))
+
+def test_resolved_query_without_items_is_a_request_error(monkeypatch):
+    monkeypatch.setattr(export, 'get_models', lambda name: {'error': 'bad request'})
+    with pytest.raises(requests.exceptions.InvalidJSONError):
+        list(export.resolve_models(['model']))
+
+def test_seeds_beyond_int64_are_exported(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    record = export.flatten(MODEL, MODEL['modelVersions'][0], {'id': 100, 'meta': {'seed': 2**64 - 1}})
+    writer = export.ParquetWriter(str(tmp_path))
+    writer.write([record], version_id=10, part='first')
+    table = pq.read_table(str(tmp_path / 'model_id=1' / 'version_id=10' / 'part-first.parquet'))
+    assert table.column('seed').to_pylist() == [str(2**64 - 1)]
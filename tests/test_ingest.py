@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from civitai_models_viewer.blobs import BlobStore
+from civitai_models_viewer.ingest import ingest_images_page
+from civitai_models_viewer.store import ModelStore, compact_model
+from civitai_models_viewer.workflows import WorkflowIndex
+
+WORKFLOW = {'workflow': {'nodes': [{'id': 3, 'type': 'KSampler', 'title': 'a "quoted" title'}]}}
+
+def page(*metas) -> bytes:
+    return json.dumps({
+        'items': [{'id': n, 'url': f"https://image.civitai.com/{n}.jpeg", 'meta': meta} for n, meta in enumerate(metas, start=1)],
+        'metadata': {'nextCursor': 'next'},
+    }).encode()
+
+@pytest.mark.parametrize('comfy', [None, WORKFLOW, [1, 2]])
+def test_comfy_not_a_string_is_kept(comfy):
+    blobs = BlobStore()
+    ingested = ingest_images_page(page({'prompt': 'red', 'comfy': comfy}, {'prompt': 'blue'}), blobs)
+    assert [img['id'] for img in ingested['items']] == [1, 2]
+    assert ingested['metadata'] == {'nextCursor': 'next'}
+    assert ingested['items'][0]['meta'] == {'prompt': 'red', 'comfy': comfy}
+    assert ModelStore(1024, blobs).image_meta(ingested['items'][1]) == {'prompt': 'blue'}
+
+def test_comfy_string_is_spilled():
+    blobs = BlobStore()
+    ingested = ingest_images_page(page({'prompt': 'red', 'comfy': json.dumps(WORKFLOW)}), blobs)
+    img = ingested['items'][0]
+    assert isinstance(img['meta']['comfy'], list)
+    assert ModelStore(1024, blobs).image_meta(img) == {'prompt': 'red', 'comfy': img['meta']['comfy']}
+    workflows = WorkflowIndex(blobs)
+    workflows.ingest(img)
+    assert json.loads(workflows.blob(1)) == WORKFLOW
+
+def test_images_ingested_again_are_not_written_again():
+    blobs = BlobStore()
+    body = page({'prompt': 'red', 'comfy': json.dumps(WORKFLOW)}, {'prompt': 'blue'})
+    first = ingest_images_page(body, blobs)
+    size = blobs.nbytes
+    assert ingest_images_page(body, blobs) == first
+    assert blobs.nbytes == size
+
+def test_model_descriptions_are_written_once_per_content():
+    blobs = BlobStore()
+    model = {'id': 1, 'name': 'model', 'description': '<p>model</p>'}
+    first = compact_model(model, blobs)
+    size = blobs.nbytes
+    assert compact_model(model, blobs) == first
+    assert blobs.nbytes == size
+    updated = compact_model({**model, 'description': '<p>updated</p>'}, blobs)
+    assert ModelStore(1024, blobs).description(updated) == '<p>updated</p>'
+    assert ModelStore(1024, blobs).description(first) == '<p>model</p>'
+
+def test_page_without_items_is_invalid():
+    with pytest.raises(ValueError):
+        ingest_images_page(b'{"error": "bad request"}', BlobStore())
+
+def test_blob_store_drops_oldest_segments_over_budget():
+    blobs = BlobStore(max_bytes=400, segments=4)
+    first = blobs.put_many([bytes(100)], keys=['first'])[0]
+    for _ in range(5):
+        blobs.put(bytes(100))
+    assert blobs.nbytes <= 500
+    assert blobs.reclaimed == 100
+    assert blobs.ref('first') is None
+    with pytest.raises(KeyError):
+        blobs.get(first)
+
+def test_entries_referring_to_dropped_blobs_are_evicted():
+    blobs = BlobStore(max_bytes=4096, segments=4)
+    store = ModelStore(1 << 20, blobs)
+    ingested = ingest_images_page(page({'prompt': 'red', 'comfy': json.dumps(WORKFLOW)}), blobs)
+    store.put(('images', 10), ingested)
+    assert store.get(('images', 10)) is not None
+    while blobs.floor <= ingested['items'][0]['raw'][0]:
+        blobs.put(bytes(1024))
+    assert store.get(('images', 10)) is None
+    assert store.raw_image(ingested['items'][0]) == ingested['items'][0]
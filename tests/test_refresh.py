@@ -0,0 +1,24 @@
+import threading
+import time
+
+from civitai_models_viewer import refresh
+from civitai_models_viewer.blobs import BlobStore
+from civitai_models_viewer.store import ModelStore
+
+def test_errors_are_recorded_and_the_refresher_keeps_running(monkeypatch):
+    calls = []
+    def get_model(model_id, revalidate=False):
+        calls.append((model_id, revalidate))
+        raise KeyError('modelVersions')
+    monkeypatch.setattr(refresh, 'get_model', get_model)
+    refresher = refresh.Refresher(ModelStore(2**20, BlobStore()), (1,), interval=0.01, rate=1000, ingest=lambda *args: None)
+    thread = threading.Thread(target=refresher.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 5
+    while len(calls) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    refresher.stop()
+    thread.join(timeout=5)
+    assert len(calls) >= 2
+    assert calls[0] == (1, True)
+    assert 'modelVersions' in refresher.errors[1]
@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from civitai_models_viewer.bench import MockCivitai, MockConfig
+from civitai_models_viewer.scheduler import RequestScheduler, TokenBucket
+
+@pytest.fixture
+def mock(request):
+    server = MockCivitai(MockConfig(**{'latency': 0.01, **getattr(request, 'param', {})})).start()
+    yield server
+    server.stop()
+
+def scheduler(**options) -> RequestScheduler:
+    options = {'rate': 100, 'burst': 100, 'timeout': (1, 5), 'max_retries': 3, 'backoff_base': 0.01, **options}
+    return RequestScheduler(requests.Session(), **options)
+
+def test_token_bucket_paces_requests():
+    bucket = TokenBucket(rate=20, burst=1)
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.19
+
+@pytest.mark.parametrize('mock', [{'latency': 0.2}], indirect=True)
+def test_identical_requests_in_flight_are_coalesced(mock):
+    gate = scheduler()
+    with ThreadPoolExecutor(8) as executor:
+        responses = list(executor.map(lambda _: gate.get(f"{mock.api_url}models/1"), range(8)))
+    assert [response.status_code for response in responses] == [200] * 8
+    assert mock.calls == {'/api/v1/models/1': 1}
+
+@pytest.mark.parametrize('mock', [{'throttle': 0.5, 'retry_after': 0.2}], indirect=True)
+def test_retry_after_is_honored(mock):
+    start = time.monotonic()
+    response = scheduler().get(f"{mock.api_url}models/1")
+    assert response.status_code == 200
+    assert mock.throttled == 1
+    assert time.monotonic() - start >= 0.2
+
+@pytest.mark.parametrize('mock', [{'throttle': 0.75, 'retry_after': None}], indirect=True)
+def test_backoff_without_retry_after(mock):
+    response = scheduler().get(f"{mock.api_url}models/1")
+    assert response.status_code == 200
+    assert mock.throttled == 3
+
+@pytest.mark.parametrize('mock', [{'throttle': 1.0, 'retry_after': None}], indirect=True)
+def test_throttled_answer_returned_once_retries_exhausted(mock):
+    response = scheduler(max_retries=2).get(f"{mock.api_url}models/1")
+    assert response.status_code == 429
+    assert mock.throttled == 3
+
+@pytest.mark.parametrize('mock', [{'throttle': 1.0, 'retry_after': 60}], indirect=True)
+def test_retry_after_beyond_backoff_max_is_not_waited(mock):
+    response = scheduler(backoff_max=1).get(f"{mock.api_url}models/1")
+    assert response.status_code == 429
+    assert mock.throttled == 1
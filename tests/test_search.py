@@ -0,0 +1,37 @@
+from civitai_models_viewer.search import PromptIndex
+
+MODEL = {'id': 1, 'name': 'model'}
+VERSION = {'id': 10, 'name': 'v1'}
+
+def index(tmp_path) -> PromptIndex:
+    prompts = PromptIndex(str(tmp_path / 'prompts.sqlite'))
+    prompts.add(MODEL, VERSION, [
+        {'id': 1, 'meta': {'prompt': 'red car', 'steps': 20, 'cfgScale': 7, 'sampler': 'Euler a'}},
+        {'id': 2, 'meta': {'prompt': 'red boat', 'cfgScale': 5}},
+        {'id': 3, 'meta': {'prompt': 'blue sky', 'steps': 30, 'cfgScale': 7, 'sampler': 'DDIM'}},
+    ])
+    return prompts
+
+def ids(images: list) -> list:
+    return sorted(img['image_id'] for img in images)
+
+def test_images_without_parameters_are_kept_without_bounds(tmp_path):
+    prompts = index(tmp_path)
+    assert ids(prompts.search('red')) == [1, 2]
+    assert prompts.versions('red') == [{'model_name': 'model', 'version_name': 'v1', 'version_id': 10, 'images': 2}]
+
+def test_bounds_filter_parameters(tmp_path):
+    prompts = index(tmp_path)
+    assert ids(prompts.search('red', steps=(10, 25))) == [1]
+    assert ids(prompts.search('', cfg=(6, 8))) == [1, 3]
+    assert ids(prompts.search('', samplers=['DDIM'])) == [3]
+
+def test_facets(tmp_path):
+    facets = index(tmp_path).facets()
+    assert facets['steps'] == (20, 30)
+    assert set(facets['samplers']) == {'Euler a', 'DDIM'}
+
+def test_seeds_beyond_int64_are_indexed(tmp_path):
+    prompts = PromptIndex(str(tmp_path / 'prompts.sqlite'))
+    prompts.add(MODEL, VERSION, [{'id': 1, 'meta': {'prompt': 'red car', 'seed': 2**64 - 1}}])
+    assert [img['seed'] for img in prompts.search('red')] == [str(2**64 - 1)]